@@ -0,0 +1,166 @@
+'''
+Time and peak memory of the accession index in atlas_status against the previous per accession dict building.
+Synthetic found accessions and metadata file lists shaped like a crawl of sources_config, no filesystem access.
+
+python -m app.benchmarks.bench_accession_index -n 1000000
+'''
+
+__author__ = "agent"
+__license__ = "Apache 2.0"
+__date__ = "17/10/2026"
+
+import argparse
+import random
+import time
+import tracemalloc
+from collections import defaultdict
+from app.lib.statusCrawl import accession_index, file_accession
+
+STATUS_TYPE_ORDER = ['external', 'incoming', 'loading', 'analysing', 'processed', 'published_dev', 'published']
+
+
+def parameters():
+    parser = argparse.ArgumentParser(description='Benchmark the atlas_status accession index.')
+    parser.add_argument("-n", "--accessions", dest="accessions", type=int, default=100000, help="Number of found accessions.")
+    parser.add_argument("-s", "--sources", dest="sources", type=int, default=30, help="Number of paths in sources_config.")
+    return parser.parse_args()
+
+
+def synthetic_crawl(n, n_sources):
+    # sources_config, (path, accession) in crawl order and path -> (idf, sdrf, analysis) file lists
+    rng = random.Random(0)
+    sources_config = {}
+    for i in range(n_sources):
+        stage = rng.sample(STATUS_TYPE_ORDER, rng.randint(1, 2))
+        sources_config['/nfs/atlas/source{}'.format(i)] = dict(stage=stage, tech=rng.sample(['rnaseq', 'microarray', 'proteomics'], 2))
+    sources_config['/nfs/atlas/source0']['stage'] = list(STATUS_TYPE_ORDER)
+    paths = list(sources_config)
+
+    by_source = defaultdict(list)
+    for i in range(n):
+        for path in rng.sample(paths, rng.choice([1, 1, 1, 2, 3])):
+            by_source[path].append('E-MTAB-{}'.format(i))
+    found = [(path, accession) for path in paths for accession in by_source[path]]
+    files = {path: ([], [], []) for path in paths}
+    for path, accession in found:
+        idf, sdrf, analysis = files[path]
+        idf.append('{}/{}/{}.idf.txt'.format(path, accession, accession))
+        sdrf.append('{}/{}/{}.sdrf.txt'.format(path, accession, accession))
+        if rng.random() < 0.3:
+            analysis.append('{}/{}/{}-analysis-methods.tsv'.format(path, accession, accession))
+    return sources_config, found, files
+
+
+def legacy_index(sources_config, status_type_order, found, files):
+    # previous implementation, kept here for comparison
+    found_accessions = {}
+    for path, accession in found:
+        info = sources_config[path]
+        found_accessions[(path, accession)] = dict(accession=accession, tech=info.get('tech', None), stage=info.get('stage', None),
+                                                   resource=info.get('resource', None), source=info.get('source', None))
+
+    accession_status = {}
+    accession_status_counter = {}
+    for key, value in found_accessions.items():
+        accession = value['accession']
+        stage = value['stage']
+        index = status_type_order.index(stage[-1])
+        if accession not in accession_status_counter:
+            accession_status_counter[accession] = index
+            accession_status[accession] = ' '.join(stage)
+        elif index > accession_status_counter.get(accession):
+            accession_status_counter[accession] = index
+            accession_status[accession] = ' '.join(stage)
+
+    accession_min_status = {}
+    accession_max_status = {}
+    for accession, status in accession_status.items():
+        accession_min_status[accession] = status_type_order[min([status_type_order.index(x) for x in status.split(' ')])]
+        accession_max_status[accession] = status_type_order[max([status_type_order.index(x) for x in status.split(' ')])]
+
+    def list_converter(file_list):
+        files_found = {}
+        for filepath in file_list:
+            accession = file_accession(filepath)
+            if accession in files_found:
+                files_found[accession].append(filepath)
+            else:
+                files_found[accession] = [filepath]
+        return files_found
+
+    preordered_paths = []
+    latest_stage_ranks = []
+    for path, metadata in sources_config.items():
+        preordered_paths.append(path)
+        latest_stage_ranks.append(max([status_type_order.index(n) for n in metadata.get('stage')]))
+    ranked_paths = [x for _, x in sorted(zip(latest_stage_ranks, preordered_paths))]
+
+    def get_latter_ranked_path(paths_by_accession):
+        ranked_paths_by_accession = {}
+        for accession, path_list in paths_by_accession.items():
+            if len(path_list) == 1:
+                latest_path = path_list[0]
+            else:
+                try:
+                    trunc_paths = [v.split('/E-')[0] for v in path_list]
+                    path_ranks = [ranked_paths.index(n) for n in trunc_paths]
+                    latest_path = path_list[path_ranks.index(max(path_ranks))]
+                except ValueError:
+                    continue
+            ranked_paths_by_accession[accession] = latest_path
+        return ranked_paths_by_accession
+
+    lookups = [get_latter_ranked_path(list_converter([f for x in files.values() for f in x[kind]])) for kind in range(3)]
+    paths_by_accession = defaultdict(list)
+    for k, v in found_accessions.items():
+        paths_by_accession[v.get('accession')].append(k[0])
+    path_by_accession = get_latter_ranked_path(paths_by_accession)
+    tech = {accession: sorted(sources_config.get(path).get('tech')) for accession, path in path_by_accession.items()}
+
+    return dict(status=accession_status, min_status=accession_min_status, max_status=accession_max_status,
+                idf=lookups[0], sdrf=lookups[1], analysis=lookups[2], path=path_by_accession, tech=tech)
+
+
+def indexed(sources_config, status_type_order, found, files):
+    index = accession_index(sources_config, status_type_order)
+    for path, accession in found:
+        index.add(path, accession)
+    for path, file_lists in files.items():
+        for kind, file_list in zip(('idf', 'sdrf', 'analysis'), file_lists):
+            for filepath in file_list:
+                index.add_file(kind, path, filepath)
+    return dict(status=index.status(), min_status=index.min_status(), max_status=index.max_status(),
+                idf=index.files['idf'], sdrf=index.files['sdrf'], analysis=index.files['analysis'],
+                path=index.path(), tech=index.tech())
+
+
+def measure(label, fn):
+    # timed without tracemalloc, its overhead would dominate
+    start = time.perf_counter()
+    lookups = fn()
+    elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for name in ('status', 'path', 'tech'):
+        lookup = lookups[name]
+        for accession in lookup:
+            lookup[accession]
+    lookup_elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    kept = fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    del kept
+    print('{:<8} build {:>7.2f} s  lookups {:>6.2f} s {:>10.1f} MiB peak {:>10} accessions'.format(
+        label, elapsed, lookup_elapsed, peak / 2 ** 20, len(lookups['status'])))
+    return lookups
+
+
+if __name__ == '__main__':
+    args = parameters()
+    sources_config, found, files = synthetic_crawl(args.accessions, args.sources)
+    legacy = measure('legacy', lambda: legacy_index(sources_config, STATUS_TYPE_ORDER, found, files))
+    index = measure('index', lambda: indexed(sources_config, STATUS_TYPE_ORDER, found, files))
+    for name, lookup in legacy.items():
+        assert list(lookup.items()) == list(index[name].items()), '{} differs'.format(name)
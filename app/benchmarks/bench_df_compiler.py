@@ -0,0 +1,79 @@
+'''
+Time of the summary dataframe construction in tracker_build against the previous row-wise construction.
+Synthetic accession keyed dictionaries shaped like those passed in df_compiler, with partial coverage per column.
+
+python -m app.benchmarks.bench_df_compiler -n 100000
+'''
+
+__author__ = "agent"
+__license__ = "Apache 2.0"
+__date__ = "17/10/2026"
+
+import argparse
+import random
+import time
+import numpy as np
+import pandas as pd
+from app.lib.trackerBuild import tracker_build
+
+STATUS_TYPE_ORDER = ['external', 'incoming', 'loading', 'analysing', 'processed', 'published_dev', 'published']
+COLUMNS = ["Status", "Tech Type", "Web Link", "Discovery Location", "Investigation Title", "Experiment Type",
+           "Analysis Type", "Organism", "Organism Status", "Single-cell Experiment Type", "Secondary Accessions",
+           "IDF", "SDRF", "Last Modified", "Atlas Eligibility", "GeneQuantSoft", "GQSVersion", "MappingSoft",
+           "MappingSoftVersion", "E!Version", "TransQuantSoft", "TQSVersion", "Curator", "min_status", "max_status"]
+
+
+def parameters():
+    parser = argparse.ArgumentParser(description='Benchmark tracker_build.build_frame.')
+    parser.add_argument("-n", "--accessions", dest="accessions", type=int, default=100000, help="Number of accessions.")
+    return parser.parse_args()
+
+
+def synthetic_input_dicts(n):
+    rng = random.Random(0)
+    accessions = ['E-MTAB-{}'.format(i) for i in range(n)]
+    status = {a: rng.choice(STATUS_TYPE_ORDER) for a in accessions}
+    input_dicts = {}
+    for colname in COLUMNS:
+        if colname in ('Status', 'min_status', 'max_status'):
+            input_dicts[colname] = dict(status)
+        elif colname in ('Investigation Title', 'Secondary Accessions', 'Tech Type'):
+            input_dicts[colname] = {a: ['{} {}'.format(colname, a), 'GSE{}'.format(i)] for i, a in enumerate(accessions) if rng.random() < 0.8}
+        elif colname == 'Atlas Eligibility':
+            input_dicts[colname] = {a: rng.choice(['PASS', 'FAIL', 3, np.nan]) for a in accessions if rng.random() < 0.5}
+        else:
+            input_dicts[colname] = {a: '{} {}'.format(colname, a) for a in accessions if rng.random() < 0.7}
+    # accessions found in the db but not in the crawl have no status
+    input_dicts['Web Link'].update({'E-GEOD-{}'.format(i): 'https://www.ebi.ac.uk/gxa/experiments/E-GEOD-{}'.format(i) for i in range(n // 100)})
+    return input_dicts
+
+
+def legacy_build_frame(input_dicts, status_type_order):
+    # previous implementation, kept here for comparison
+    input_data = {}
+    for colname, input_dict in input_dicts.items():
+        for accession, value in input_dict.items():
+            if accession not in input_data:
+                input_data[accession] = {colname: value}
+            else:
+                input_data[accession].update({colname: value})
+
+    full_df = pd.DataFrame.from_dict(input_data, orient='index')
+    nan_filtered_df = full_df[pd.notnull(full_df['Status'])].copy()
+    nan_filtered_df['min_order_index'] = nan_filtered_df.apply(lambda x: status_type_order.index(x['min_status']), axis=1)
+    return nan_filtered_df
+
+
+def measure(label, fn):
+    start = time.perf_counter()
+    df = fn()
+    print('{:<10} {:>8.2f} s {:>10} rows'.format(label, time.perf_counter() - start, len(df)))
+    return df
+
+
+if __name__ == '__main__':
+    args = parameters()
+    input_dicts = synthetic_input_dicts(args.accessions)
+    legacy = measure('legacy', lambda: legacy_build_frame(input_dicts, STATUS_TYPE_ORDER))
+    vectorized = measure('vectorized', lambda: tracker_build.build_frame(input_dicts, STATUS_TYPE_ORDER))
+    pd.testing.assert_frame_equal(legacy, vectorized)
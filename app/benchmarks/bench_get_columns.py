@@ -0,0 +1,75 @@
+'''
+Time and peak memory of db_crawler.get_columns against the previous dict-per-row fetch.
+Uses a local SQLite table shaped like the autosubs experiments table as a stand-in for production dbs.
+
+python -m app.benchmarks.bench_get_columns -n 1000000
+'''
+
+__author__ = "agent"
+__license__ = "Apache 2.0"
+__date__ = "17/10/2026"
+
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+import pandas as pd
+from app.lib.dbCrawl import db_crawler
+
+COLUMNS = ['accession', 'atlas_fail_score', 'name', 'submitter']
+
+
+def parameters():
+    parser = argparse.ArgumentParser(description='Benchmark db_crawler.get_columns on a SQLite stand-in.')
+    parser.add_argument("-n", "--rows", dest="rows", type=int, default=500000, help="Rows in the stand-in table.")
+    parser.add_argument("-b", "--batch_size", dest="batch_size", type=int, default=10000, help="fetchmany batch size.")
+    return parser.parse_args()
+
+
+def legacy_get_columns(db, table, columns):
+    # previous implementation, kept here for comparison
+    cursor = db.cursor()
+    query = "SELECT {} FROM {}".format(', '.join(columns), table)
+    cursor.execute(query)
+    result = []
+    for row in cursor:
+        if row[0]:
+            result.append({k: row[idx] for idx, k in enumerate(columns)})
+
+    return pd.DataFrame(result).set_index(columns[0])
+
+
+def build_table(path, rows):
+    db = sqlite3.connect(path)
+    db.execute('CREATE TABLE experiments ({})'.format(', '.join(COLUMNS)))
+    db.executemany('INSERT INTO experiments VALUES (?, ?, ?, ?)',
+                   (('E-MTAB-{}'.format(i) if i % 50 else None, i % 7, 'experiment {}'.format(i), 'submitter {}'.format(i % 97))
+                    for i in range(rows)))
+    db.commit()
+    return db
+
+
+def measure(label, fn):
+    # timed without tracemalloc, its overhead would dominate
+    start = time.perf_counter()
+    df = fn()
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print('{:<10} {:>8.2f} s {:>10.1f} MiB peak {:>10} rows'.format(label, elapsed, peak / 2 ** 20, len(df)))
+    return df
+
+
+if __name__ == '__main__':
+    args = parameters()
+    with tempfile.TemporaryDirectory() as tmp:
+        db = build_table(os.path.join(tmp, 'autosubs.sqlite'), args.rows)
+        legacy = measure('legacy', lambda: legacy_get_columns(db, 'experiments', COLUMNS))
+        batched = measure('batched', lambda: db_crawler.get_columns(db, 'experiments', COLUMNS, batch_size=args.batch_size))
+        pd.testing.assert_frame_equal(legacy, batched)
+        db.close()
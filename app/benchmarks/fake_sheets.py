@@ -0,0 +1,197 @@
+'''
+Local fake of the sheets v4 api and a check of google_sheet_output against it, no google account needed.
+Covers an upload interrupted by quota errors and resumed, a delta upload and the fall back to a full write after
+a curator sorted the published worksheet.
+
+python -m app.benchmarks.fake_sheets -n 2000
+'''
+
+__author__ = "agent"
+__license__ = "Apache 2.0"
+__date__ = "17/10/2026"
+
+import argparse
+import json
+import re
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import pandas as pd
+from app.lib import googleAPI
+from app.lib import sheetDelta
+from app.lib import sheetWriter
+
+RANGE_REGEX = re.compile(r"^'(.*)'!A(\d*):[A-Z]+(\d*)$")
+
+
+class fake_sheets_api:
+    '''
+    One spreadsheet held in memory: sheetId -> properties and sheetId -> {row: values} (row 0 is the header).
+    Supports the calls google_sheet_output makes. After quota_after value writes every further one is
+    answered with 429 until quota_after is raised again.
+    '''
+
+    def __init__(self):
+        self.sheets = {0: {'sheetId': 0, 'title': 'Sheet1', 'gridProperties': {'rowCount': 1000, 'columnCount': 26}}}
+        self.cells = {0: {}}
+        self.value_writes = 0
+        self.quota_after = float('inf')
+        self.requests = 0
+        self.lock = threading.Lock()
+        api = self
+
+        class handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def reply(self, code, obj):
+                body = json.dumps(obj).encode()
+                self.send_response(code)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                with api.lock:
+                    api.requests += 1
+                    url = urlparse(self.path)
+                    if url.path.endswith('values:batchGet'):
+                        return self.reply(200, {'valueRanges': [{'range': x, 'values': api.get_range(x)}
+                                                                for x in parse_qs(url.query).get('ranges', [])]})
+                    self.reply(200, {'sheets': [{'properties': x} for x in api.sheets.values()]})
+
+            def do_POST(self):
+                with api.lock:
+                    api.requests += 1
+                    body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                    if self.path.split('?')[0].endswith('values:batchUpdate'):
+                        api.value_writes += 1
+                        if api.value_writes > api.quota_after:
+                            return self.reply(429, {'error': {'code': 429, 'message': 'Quota exceeded'}})
+                        for x in body['data']:
+                            api.set_range(x['range'], x['values'])
+                        return self.reply(200, {})
+                    for request in body['requests']:
+                        api.apply(request)
+                    self.reply(200, {})
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.endpoint = 'http://127.0.0.1:{}/'.format(self.server.server_port)
+
+    def sheet_id(self, title):
+        return next(x for x, properties in self.sheets.items() if properties['title'] == title)
+
+    def get_range(self, a1):
+        title, first, last = RANGE_REGEX.match(a1).groups()
+        sheet_id = self.sheet_id(title.replace("''", "'"))
+        first = int(first or 1) - 1
+        last = int(last) if last else self.sheets[sheet_id]['gridProperties']['rowCount']
+        rows = [self.cells[sheet_id].get(i, []) for i in range(first, last)]
+        while rows and not rows[-1]:
+            rows.pop()
+        return rows
+
+    def set_range(self, a1, values):
+        title, first, _ = RANGE_REGEX.match(a1).groups()
+        sheet_id = self.sheet_id(title.replace("''", "'"))
+        for i, row in enumerate(values):
+            self.cells[sheet_id][int(first) - 1 + i] = [str(x) for x in row]
+
+    def apply(self, request):
+        if 'addSheet' in request:
+            properties = dict(request['addSheet']['properties'])
+            self.sheets[properties['sheetId']] = properties
+            self.cells[properties['sheetId']] = {}
+        elif 'deleteSheet' in request:
+            del self.sheets[request['deleteSheet']['sheetId']]
+        elif 'updateSheetProperties' in request and 'rowCount' in json.dumps(request):
+            properties = request['updateSheetProperties']['properties']
+            self.sheets[properties['sheetId']]['gridProperties'].update(properties['gridProperties'])
+        elif 'appendDimension' in request:
+            self.sheets[request['appendDimension']['sheetId']]['gridProperties']['rowCount'] += request['appendDimension']['length']
+        elif 'deleteDimension' in request:
+            span = request['deleteDimension']['range']
+            start, stop = span['startIndex'], span['endIndex']
+            cells = self.cells[span['sheetId']]
+            self.cells[span['sheetId']] = {(i if i < start else i - (stop - start)): row for i, row in cells.items()
+                                           if not start <= i < stop}
+            self.sheets[span['sheetId']]['gridProperties']['rowCount'] -= stop - start
+
+    def sort_rows(self, title):
+        # what a curator sorting the data rows of a worksheet by column B does
+        cells = self.cells[self.sheet_id(title)]
+        rows = sorted((cells[i] for i in cells if i > 0), key=lambda x: x[1:2])
+        cells.update({i + 1: row for i, row in enumerate(rows)})
+
+    def worksheet(self, name):
+        # values of the single tab whose title starts with name
+        sheet_id = next(x for x, properties in self.sheets.items() if properties['title'].startswith(name))
+        rows = self.sheets[sheet_id]['gridProperties']['rowCount']
+        return self.sheets[sheet_id]['title'], [self.cells[sheet_id].get(i, []) for i in range(rows)]
+
+
+def parameters():
+    parser = argparse.ArgumentParser(description='Check google_sheet_output against a local fake sheets api.')
+    parser.add_argument("-n", "--rows", dest="rows", type=int, default=2000, help="Rows in the test frame.")
+    return parser.parse_args()
+
+
+def expected(df):
+    return [[str(x) for x in row] for row in sheetDelta.frame_values(df)]
+
+
+def upload(api, output_dfs, tmp, mode):
+    googleAPI.google_sheet_output(None, output_dfs, 'fake', mode=mode, snapshot_dir=tmp + '/snapshots',
+                                  progress_path=tmp + '/progress.json', endpoint=api.endpoint, spreadsheet_id='fake',
+                                  writer_options=dict(chunk_cells=1000, requests_per_minute=6000, base_delay=0.01,
+                                                      max_delay=0.05, max_attempts=3))
+
+
+if __name__ == '__main__':
+    args = parameters()
+    api = fake_sheets_api()
+    tmp = tempfile.mkdtemp()
+    df = pd.DataFrame({'Status': ['loading'] * args.rows, 'Title': ['title {}'.format(i) for i in range(args.rows)]},
+                      index=pd.Index(['E-MTAB-{}'.format(i) for i in range(args.rows)], name='Accession'))
+
+    # quota runs out part way, the second run resumes from the chunks already written
+    api.quota_after = 2
+    try:
+        upload(api, {'Tracker': df}, tmp, 'delta')
+        interrupted = None
+    except Exception as e:
+        interrupted = e
+    assert interrupted is not None, 'upload was expected to run out of quota'
+    with open(tmp + '/progress.json') as f:
+        done = len(json.load(f)['done'])
+    chunks = len(sheetWriter.chunk_blocks([('Tracker', 0, sheetDelta.frame_values(df))], 1000))
+    assert 0 < done < chunks
+    print('interrupted with {} of {} value chunks written: {}'.format(done, chunks, type(interrupted).__name__))
+    api.quota_after = float('inf')
+    writes = api.value_writes
+    upload(api, {'Tracker': df}, tmp, 'delta')
+    assert api.worksheet('Tracker')[1] == expected(df)
+    assert api.value_writes - writes == chunks - done, 'chunks written before the interruption should be skipped'
+    print('resumed upload: {} value chunks written after the interruption'.format(api.value_writes - writes))
+
+    # delta: a changed, a removed and an added row
+    df = df.drop('E-MTAB-3')
+    df.loc['E-MTAB-5', 'Status'] = 'published'
+    df.loc['E-MTAB-{}'.format(args.rows)] = ['incoming', 'new']
+    title = api.worksheet('Tracker')[0]
+    requests = api.requests
+    upload(api, {'Tracker': df}, tmp, 'delta')
+    assert api.worksheet('Tracker')[0] == title, 'delta should update the published worksheet in place'
+    assert api.worksheet('Tracker')[1] == expected(df)
+    print('delta upload: {} api requests'.format(api.requests - requests))
+
+    # a curator sorts the sheet, the delta must not write rows at their old positions
+    api.sort_rows(title)
+    df.loc['E-MTAB-7', 'Status'] = 'processed'
+    upload(api, {'Tracker': df}, tmp, 'delta')
+    assert api.worksheet('Tracker')[0] != title, 'sorted worksheet should be rewritten in full'
+    assert api.worksheet('Tracker')[1] == expected(df)
+    print('sorted worksheet rewritten in full')
@@ -0,0 +1,67 @@
+'''
+Check of the http_fetcher retries against a local stub server, no GitHub access needed.
+A rate limit (429, or 403 with Retry-After) is retried and then fetched, a 403 without Retry-After surfaces at once.
+
+python -m app.benchmarks.rate_limit_retry
+'''
+
+__author__ = "agent"
+__license__ = "Apache 2.0"
+__date__ = "17/10/2026"
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
+from app.lib import httpFetch
+
+
+class stub_server:
+    '''
+    Answers each path with the queued (status, headers) responses first, then 200 with a species tree.
+    '''
+
+    def __init__(self):
+        self.queued = {}
+        self.hits = {}
+        stub = self
+
+        class handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                stub.hits[self.path] = stub.hits.get(self.path, 0) + 1
+                queued = stub.queued.get(self.path)
+                status, headers = queued.pop(0) if queued else (200, {})
+                body = json.dumps({'tree': [{'path': 'homo_sapiens'}]} if status == 200 else {'message': 'denied'}).encode()
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:{}'.format(self.server.server_port)
+
+
+if __name__ == '__main__':
+    stub = stub_server()
+    stub.queued['/rate_limited'] = [(403, {'Retry-After': '0'}), (429, {'Retry-After': '0'}), (429, {})]
+    stub.queued['/forbidden'] = [(403, {})]
+    http = httpFetch.http_fetcher(retries=3, backoff_factor=0)
+    try:
+        assert http.get_json(stub.url + '/rate_limited')['tree'], 'rate limited url should be fetched'
+        assert stub.hits['/rate_limited'] == 4
+        print('rate limited url fetched after {} requests'.format(stub.hits['/rate_limited']))
+        try:
+            http.get_json(stub.url + '/forbidden')
+            raise AssertionError('403 without Retry-After should raise')
+        except requests.exceptions.HTTPError as e:
+            assert e.response.status_code == 403 and stub.hits['/forbidden'] == 1
+        print('403 without Retry-After raised after {} request'.format(stub.hits['/forbidden']))
+    finally:
+        http.close()
+        stub.server.shutdown()
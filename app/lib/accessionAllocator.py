@@ -0,0 +1,85 @@
+'''
+high water marks of internal accession numbers per prefix, for minting new accessions
+
+The store is a small json file, prefix -> highest number in use (e.g. {"PROT": 52}). Tracker runs raise the
+marks to the highest accession they crawled and every allocation raises its prefix past the numbers it hands out,
+so minting an accession reads and writes one small file instead of crawling the sources.
+Reads and writes hold an exclusive flock on <store>.lock so concurrent curators never get the same number.
+Marks only ever go up: numbers allocated but not yet visible to the crawl stay reserved.
+'''
+__author__ = "agent"
+__license__ = "Apache 2.0"
+__date__ = "17/10/2026"
+
+import fcntl
+import json
+import os
+import re
+from contextlib import contextmanager
+from app.lib import atomicFile
+
+ACCESSION_REGEX = re.compile('^E-([A-Z]{4})-([0-9]+)$')
+
+
+@contextmanager
+def locked_marks(path):
+    '''
+    Yields the marks dict under an exclusive lock, changes made to it are saved when the block exits cleanly
+    '''
+    atomicFile.make_dir(os.path.dirname(path))
+    with open(path + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            marks = read_marks(path)
+            before = dict(marks)
+            yield marks
+            if marks != before:
+                atomicFile.write_json(path, marks, fsync=True, indent=1, sort_keys=True)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def read_marks(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def crawled_marks(accessions):
+    '''
+    highest accession number per prefix in accessions
+    '''
+    marks = {}
+    for accession in accessions:
+        match = ACCESSION_REGEX.match(accession)
+        if match:
+            prefix, number = match.group(1), int(match.group(2))
+            if number > marks.get(prefix, 0):
+                marks[prefix] = number
+    return marks
+
+
+def update(path, accessions):
+    '''
+    Raises the marks to the highest crawled accession of each prefix. Returns the prefixes that went up.
+    '''
+    crawled = crawled_marks(accessions)
+    with locked_marks(path) as marks:
+        raised = {prefix: number for prefix, number in crawled.items() if number > marks.get(prefix, 0)}
+        marks.update(raised)
+    print('Accession marks: {} prefixes raised'.format(len(raised)))
+    return raised
+
+
+def allocate(path, prefix, count=1):
+    '''
+    Returns the next count accessions of prefix and reserves them. The store must have been written by a tracker
+    run, otherwise numbers already in use could be handed out again.
+    '''
+    if not os.path.exists(path):
+        raise FileNotFoundError('No accession marks at {}. They are written by run_status_crawler.py'.format(path))
+    with locked_marks(path) as marks:
+        first = marks.get(prefix, 0) + 1
+        marks[prefix] = first + count - 1
+    return ['E-{}-{}'.format(prefix, number) for number in range(first, first + count)]
@@ -0,0 +1,115 @@
+'''
+on-disk lookup of internal accessions for the dev tools duplication checks
+
+Maps accessions to the internal accessions they belong to, by kind:
+primary (an internal accession found in the crawl, not only on external sources), secondary (listed as Secondary Accession in an idf) and
+geo (GSExxx of an E-GEOD-xxx found in the crawl). It is a single SQLite table keyed on the queried accession,
+rewritten at the end of each tracker run, so a check is a few indexed queries and needs neither pandas nor the
+run snapshot.
+'''
+__author__ = "agent"
+__license__ = "Apache 2.0"
+__date__ = "17/10/2026"
+
+import os
+import re
+import sqlite3
+from urllib.request import pathname2url
+from app.lib import atomicFile
+
+KINDS = ('primary', 'secondary', 'geo')
+BATCH = 500  # accessions per query, below the SQLite host parameter limit
+
+SCHEMA = '''
+CREATE TABLE lookup (accession TEXT NOT NULL, kind TEXT NOT NULL, internal TEXT NOT NULL,
+                     PRIMARY KEY (accession, kind, internal)) WITHOUT ROWID;
+CREATE TABLE info (key TEXT PRIMARY KEY, value TEXT);
+'''
+GEOD_REGEX = re.compile('^E-GEOD-([0-9]+)$')
+
+
+def secondary_pairs(secondary_by_accession):
+    '''
+    (accession, secondary accession) pairs from the extracted Secondary Accession metadata, a string or list each
+    '''
+    pairs = []
+    for accession, secondary in (secondary_by_accession or {}).items():
+        for x in (secondary if isinstance(secondary, list) else [secondary]):
+            if isinstance(x, str) and x:
+                pairs.append((accession, x))
+    return pairs
+
+
+def lookup_rows(primary_accessions, secondary_by_accession):
+    # secondary accessions are only kept for the given primary accessions
+    primary_accessions = set(primary_accessions)
+    rows = set()
+    for accession in primary_accessions:
+        rows.add((accession, 'primary', accession))
+        geod = GEOD_REGEX.match(accession)
+        if geod:
+            rows.add(('GSE' + geod.group(1), 'geo', accession))
+    for accession, secondary in secondary_pairs(secondary_by_accession):
+        if accession in primary_accessions:
+            rows.add((secondary.strip(), 'secondary', accession))
+    return rows
+
+
+def write_lookup(db_path, timestamp, primary_accessions, secondary_by_accession):
+    '''
+    Rewrites the lookup from the internal accessions of a run. Readers keep the previous file until the new one replaces it.
+    Returns the number of entries.
+    '''
+    rows = lookup_rows(primary_accessions, secondary_by_accession)
+    with atomicFile.atomic_path(db_path) as tmp_path:
+        db = sqlite3.connect(tmp_path)
+        try:
+            db.executescript(SCHEMA)
+            with db:
+                db.executemany('INSERT INTO lookup VALUES (?, ?, ?)', sorted(rows))
+                db.execute('INSERT INTO info VALUES (?, ?)', ('timestamp', timestamp))
+        finally:
+            db.close()
+    print('Accession lookup: {} entries written to {}'.format(len(rows), db_path))
+    return len(rows)
+
+
+def connect(db_path):
+    # read only, a missing lookup is an error instead of an empty new database
+    if not os.path.exists(db_path):
+        raise FileNotFoundError('No accession lookup at {}. It is written by run_status_crawler.py, '
+                                'or run accession_lookup.py --rebuild'.format(db_path))
+    return sqlite3.connect('file:{}?mode=ro'.format(pathname2url(os.path.abspath(db_path))), uri=True)
+
+
+def lookup(db_path, accessions, kinds=KINDS):
+    '''
+    returns {accession: [(kind, internal accession)]} for the given accessions that are known, kinds limits the
+    kinds of match (see KINDS)
+    '''
+    accessions = list(dict.fromkeys(x.strip() for x in accessions))
+    kinds = list(kinds)
+    found = {}
+    db = connect(db_path)
+    try:
+        for i in range(0, len(accessions), BATCH):
+            batch = accessions[i:i + BATCH]
+            query = 'SELECT accession, kind, internal FROM lookup WHERE accession IN ({}) AND kind IN ({})'.format(
+                ', '.join('?' * len(batch)), ', '.join('?' * len(kinds)))
+            for accession, kind, internal in db.execute(query, batch + kinds):
+                found.setdefault(accession, []).append((kind, internal))
+    finally:
+        db.close()
+    return found
+
+
+def built(db_path):
+    '''
+    timestamp of the run that wrote the lookup
+    '''
+    db = connect(db_path)
+    try:
+        row = db.execute("SELECT value FROM info WHERE key = 'timestamp'").fetchone()
+    finally:
+        db.close()
+    return row[0] if row else None
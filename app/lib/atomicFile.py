@@ -0,0 +1,48 @@
+'''
+atomic writes of local state files (caches, snapshots, progress, registries, lookups)
+
+A file is written to <path>.tmp and moved into place with os.replace once complete, so readers and
+interrupted runs never see a partial file. Missing parent directories are created.
+'''
+__author__ = "agent"
+__license__ = "Apache 2.0"
+__date__ = "17/10/2026"
+
+import json
+import os
+from contextlib import contextmanager
+
+
+def make_dir(path):
+    if path and not os.path.exists(path):
+        os.makedirs(path, exist_ok=True)
+
+
+@contextmanager
+def atomic_path(path):
+    '''
+    Yields the temporary path to write to. It replaces path when the block exits cleanly and is removed otherwise.
+    '''
+    make_dir(os.path.dirname(path))
+    tmp_path = path + '.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def write_json(path, data, fsync=False, **kwargs):
+    '''
+    json.dump of data to path, kwargs are passed to json.dump. fsync flushes it to disk before the rename.
+    '''
+    with atomic_path(path) as tmp_path:
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f, **kwargs)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
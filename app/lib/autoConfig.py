@@ -0,0 +1,147 @@
+'''
+generation of Expression Atlas config files (config.auto) for atlas-eligible bulk RNA-seq studies
+
+The curation conda environment is activated once per run and its environment variables are reused for every job,
+so jobs don't pay the `conda run` start-up. Experiments are processed in a bounded thread pool, each job tries
+differential then baseline generation for its experiment and every generation call has a timeout.
+Attempts are kept in a registry so an experiment that failed is only retried when its inputs change or after
+a retry interval.
+'''
+__author__ = "agent"
+__license__ = "Apache 2.0"
+__date__ = "17/10/2026"
+
+import json
+import logging
+import os
+import shutil
+import signal
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from tqdm import tqdm
+from app.lib import atomicFile
+
+CONDA_ENV = 'curation'
+GENERATOR = 'gxa_generateConfigurationForExperiment.pl'
+ANALYSIS_TYPES = ['differential', 'baseline']  # in the order they are tried
+FINGERPRINT_FIELDS = ['Last Modified', 'Atlas Eligibility', 'Organism', 'Analysis Type']  # inputs of a generation
+
+
+def conda_environment(env_name=CONDA_ENV):
+    '''
+    Environment variables of the activated conda env, captured with a single `conda run`.
+    Returns None if conda could not be run, jobs then fall back to `conda run` each.
+    '''
+    try:
+        out = subprocess.run(['conda', 'run', '-n', env_name, 'env', '-0'], stdout=subprocess.PIPE,
+                             stderr=subprocess.PIPE, check=True, timeout=300).stdout
+    except (OSError, subprocess.SubprocessError) as e:
+        logging.warning('Could not capture conda env {}: {}'.format(env_name, e))
+        return None
+    return dict(x.split('=', 1) for x in out.decode('utf-8', 'replace').split('\0') if '=' in x)
+
+
+def run_generator(exp, analysis_type, cwd, env, timeout):
+    '''
+    Runs one config generation. Returns the exit code, None on timeout or if the generator could not be started.
+    The job runs in its own process group so a timeout also stops the processes it started.
+    '''
+    cmd = [GENERATOR, '-e', exp, '-t', analysis_type, '-p', 'annotare' if 'MTAB' in exp else 'geo', '-o', exp]
+    if env is None:
+        cmd = ['conda', 'run', '-n', CONDA_ENV] + cmd
+    try:
+        proc = subprocess.Popen(cmd, cwd=cwd, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                start_new_session=True)
+    except OSError as e:
+        logging.warning('%s %s config generation could not start: %s', exp, analysis_type, e)
+        return None
+    try:
+        out = proc.communicate(timeout=timeout)[0]
+    except subprocess.TimeoutExpired:
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass  # the group already exited
+        proc.communicate()
+        logging.info('%s %s config generation timed out after %ss', exp, analysis_type, timeout)
+        return None
+    logging.debug('%s %s config generation output:\n%s', exp, analysis_type, out.decode('utf-8', 'replace'))
+    return proc.returncode
+
+
+def generate_config(exp, conan_incoming, env, timeout):
+    '''
+    Creates the experiment folder in conan_incoming and tries differential then baseline generation.
+    Returns the analysis type that succeeded, or None after removing the folder again.
+    Errors are logged and count as a failed attempt so they don't stop the other jobs.
+    '''
+    exp_path = os.path.join(conan_incoming, exp)
+    try:
+        os.makedirs(exp_path, exist_ok=True)
+        for analysis_type in ANALYSIS_TYPES:
+            if run_generator(exp, analysis_type, conan_incoming, env, timeout) == 0:
+                logging.info("%s %s auto config created", exp, analysis_type)
+                return analysis_type
+        logging.info('%s failed both differential and baseline config generation', exp)
+    except Exception:
+        logging.exception('%s config generation failed', exp)
+    # NFS can leave .nfs* files behind while a killed process still holds them, the folder is cleaned up best effort
+    shutil.rmtree(exp_path, ignore_errors=True)
+    logging.debug('delete %s\'s folder in conan_incoming', exp)
+    return None
+
+
+def generate_configs(experiments, conan_incoming, workers=4, timeout=3600):
+    '''
+    Generates configs for experiments concurrently in at most workers jobs.
+    Returns accession -> analysis type that succeeded (None if none did).
+    '''
+    if not experiments:
+        return {}
+    print('Generating auto configs for {} experiments'.format(len(experiments)))
+    env = conda_environment()
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        outcomes = list(tqdm(executor.map(lambda exp: generate_config(exp, conan_incoming, env, timeout), experiments),
+                             total=len(experiments), unit='experiment'))
+    return dict(zip(experiments, outcomes))
+
+
+def input_fingerprint(row):
+    '''
+    Inputs of a generation for one experiment, idf/sdrf modification time, eligibility, organism and analysis type
+    '''
+    return {field: str(row.get(field)) for field in FINGERPRINT_FIELDS}
+
+
+class attempt_registry:
+    '''
+    Outcome of the last generation attempt per accession: dict(outcome, fingerprint, timestamp), persisted as json.
+    outcome is the analysis type that succeeded or 'failed'.
+    '''
+
+    def __init__(self, path=None, retry_days=7):
+        self.path = path
+        self.retry_interval = timedelta(days=retry_days)
+        self.attempts = {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.attempts = json.load(f)
+
+    def should_attempt(self, exp, fingerprint, now=None):
+        '''
+        False for an experiment whose last attempt failed with the same inputs less than the retry interval ago
+        '''
+        last = self.attempts.get(exp)
+        if last is None or last['outcome'] != 'failed' or last['fingerprint'] != fingerprint:
+            return True
+        return (now or datetime.now()) - datetime.fromisoformat(last['timestamp']) >= self.retry_interval
+
+    def record(self, exp, outcome, fingerprint, now=None):
+        self.attempts[exp] = dict(outcome=outcome or 'failed', fingerprint=fingerprint,
+                                  timestamp=(now or datetime.now()).isoformat())
+
+    def save(self):
+        if not self.path:
+            return
+        atomicFile.write_json(self.path, self.attempts, indent=1, sort_keys=True)
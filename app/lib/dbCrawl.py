@@ -13,21 +13,46 @@ import psycopg
 import json
 import pandas as pd
 import sys
+import os
+import sqlite3
 import logging
+import threading
+import time
+from collections import OrderedDict
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from urllib.request import pathname2url
+from app.lib import atomicFile
 
 
-class db_crawler:
+FETCH_BATCH_SIZE = 10000
+SECRET_COLUMNS = ('access_key',)  # read for this run only, never written to the db snapshot
 
-    def __init__(self, db_config, status_crawl):
+# reads needed per run, name -> (db name, table, columns). columns[0] is the primary key.
+# reads of the same table are served from one query of the union of their columns, see query_cache.
+QUERIES = OrderedDict([
+    ('bulk_experiments', ('gxpatlaspro', 'experiment', ['accession', 'private', 'access_key'])),
+    ('sc_experiments', ('gxpscxapro', 'experiment', ['accession', 'private', 'access_key'])),
+    ('bulk_accessions', ('gxpatlaspro', 'experiment', ['accession'])),
+    ('sc_accessions', ('gxpscxapro', 'experiment', ['accession'])),
+    ('rnaseq_atlas_eligibility', ('gxpatlaspro', 'rnaseq_atlas_eligibility', ['ae2_acc', 'status'])),
+    ('autosubs_atlas_fail_score', ('ae_autosubs', 'experiments', ['accession', 'atlas_fail_score'])),
+])
 
-        # initialize
-        with open(db_config) as d:
-            self.db_config = json.load(d)
-        self.status_crawl = status_crawl
 
-        self.atlas_eligibility_status = self.get_atlas_eligibility_status()
-        self.accession_urls = self.get_accession_urls()
-        self.db_vs_crawler_check()
+class connection_pool:
+    """
+    Per run cache of db connections keyed by db name.
+    A connection is only used by one thread at a time and is reused by later queries to the same db.
+    All connections are closed together with close().
+    """
+
+    def __init__(self, db_config):
+        self.db_config = db_config
+        self.idle = defaultdict(list)
+        self.connections = []
+        self.lock = threading.Lock()
 
     def db_connect(self, name):
         """
@@ -51,59 +76,214 @@ class db_crawler:
             raise ValueError('DB type {} not interpreted. Review db_config.json.'.format(connection_details['dbtype']))
         return db
 
-    def get_columns(self, db, table, columns):
+    @contextmanager
+    def connection(self, name):
+        with self.lock:
+            db = self.idle[name].pop() if self.idle[name] else None
+        if db is None:
+            db = self.db_connect(name)
+            logging.debug("{} connected".format(name))
+            with self.lock:
+                self.connections.append(db)
+        try:
+            yield db
+        finally:
+            with self.lock:
+                self.idle[name].append(db)
+
+    def close(self):
+        with self.lock:
+            for db in self.connections:
+                try:
+                    db.close()
+                except Exception as e:
+                    logging.warning('Could not close db connection: {}'.format(e))
+            self.connections = []
+            self.idle.clear()
+
+
+class query_cache:
+    """
+    Per run cache of table reads.
+    Consumers register the columns they need with require(). fetch() then reads the union of the columns once per
+    table (concurrently across tables) and get() serves each consumer's columns from that single read.
+    All reads of a table must share the same primary key (columns[0]).
+
+    With snapshot_path and a ttl the fetched tables are persisted without their SECRET_COLUMNS, and tables in the
+    snapshot younger than ttl seconds are reused without connecting. ttl=0 always queries the dbs and saves nothing.
+    Tables read with a secret column are therefore always queried.
+    """
+
+    def __init__(self, snapshot_path=None, ttl=0):
+        self.snapshot_path = snapshot_path
+        self.ttl = ttl
+        self.columns = OrderedDict()  # (db name, table) -> union of required columns, primary key first
+        self.tables = {}  # (db name, table) -> dict(fetched=timestamp, columns=[...], frame=dataframe)
+
+    def require(self, db_name, table, columns):
+        key = (db_name, table)
+        if key not in self.columns:
+            self.columns[key] = [columns[0]]
+        assert self.columns[key][0] == columns[0], 'Reads of {}.{} use different primary keys'.format(db_name, table)
+        self.columns[key] += [x for x in columns if x not in self.columns[key]]
+
+    def get(self, db_name, table, columns):
+        frame = self.tables[(db_name, table)]['frame']
+        assert frame.index.name == columns[0], 'Reads of {}.{} use different primary keys'.format(db_name, table)
+        return frame[columns[1:]].copy()
+
+    def fetch(self, pool):
+        """
+        Queries every required table not covered by a fresh snapshot. The first failing query raises here
+        (e.g. psycopg.OperationalError).
+        """
+        if self.snapshot_path and self.ttl:
+            for key, cached in read_snapshot(self.snapshot_path).items():
+                if key in self.columns and time.time() - cached['fetched'] < self.ttl \
+                        and set(self.columns[key]) <= set(cached['columns']):
+                    logging.info('{}.{} served from snapshot {}'.format(key[0], key[1], self.snapshot_path))
+                    self.tables[key] = cached
+
+        def timed_query(db_name, table, columns):
+            start = time.monotonic()
+            with pool.connection(db_name) as db:
+                df = db_crawler.get_columns(db, table, columns)
+            logging.info("query {}.{} returned {} rows in {:.1f}s".format(db_name, table, len(df), time.monotonic() - start))
+            return dict(fetched=time.time(), columns=columns, frame=df)
+
+        pending = [key for key in self.columns if key not in self.tables]
+        if pending:
+            with ThreadPoolExecutor(max_workers=len(pending)) as executor:
+                futures = OrderedDict((key, executor.submit(timed_query, key[0], key[1], self.columns[key])) for key in pending)
+                for key, future in futures.items():
+                    self.tables[key] = future.result()
+
+        if self.snapshot_path and self.ttl and pending:
+            self.save()
+
+    def save(self):
+        snapshot = read_snapshot(self.snapshot_path)
+        for key, cached in self.tables.items():
+            columns = [x for x in cached['columns'] if x not in SECRET_COLUMNS]
+            snapshot[key] = dict(fetched=cached['fetched'], columns=columns, frame=cached['frame'][columns[1:]])
+        write_snapshot(self.snapshot_path, snapshot)
+
+
+def write_snapshot(snapshot_path, snapshot):
+    """
+    Writes the tables of a query_cache snapshot to SQLite, one table each plus a snapshot_tables listing.
+    """
+    with atomicFile.atomic_path(snapshot_path) as tmp_path:
+        db = sqlite3.connect(tmp_path)
+        try:
+            db.execute('CREATE TABLE snapshot_tables (name TEXT PRIMARY KEY, db_name TEXT NOT NULL, '
+                       'table_name TEXT NOT NULL, fetched REAL NOT NULL, columns TEXT NOT NULL)')
+            for i, ((db_name, table), cached) in enumerate(sorted(snapshot.items())):
+                name = 'table_{}'.format(i)
+                cached['frame'].to_sql(name, db, index=True, index_label=cached['columns'][0])
+                db.execute('INSERT INTO snapshot_tables VALUES (?, ?, ?, ?, ?)',
+                           (name, db_name, table, cached['fetched'], json.dumps(cached['columns'])))
+            db.commit()
+        finally:
+            db.close()
+
+
+def read_snapshot(snapshot_path):
+    """
+    returns (db name, table) -> dict(fetched=timestamp, columns=[...], frame=dataframe) from a persisted query_cache
+    """
+    if not snapshot_path or not os.path.exists(snapshot_path):
+        return {}
+    db = sqlite3.connect('file:{}?mode=ro'.format(pathname2url(os.path.abspath(snapshot_path))), uri=True)
+    try:
+        snapshot = {}
+        for name, db_name, table, fetched, columns in db.execute(
+                'SELECT name, db_name, table_name, fetched, columns FROM snapshot_tables'):
+            columns = json.loads(columns)
+            frame = pd.read_sql_query('SELECT * FROM "{}"'.format(name), db, index_col=columns[0])
+            snapshot[(db_name, table)] = dict(fetched=fetched, columns=columns, frame=frame[columns[1:]])
+        return snapshot
+    finally:
+        db.close()
+
+
+class db_crawler:
+
+    def __init__(self, db_config, status_crawl, snapshot_path=None, snapshot_ttl=0):
+
+        # initialize
+        with open(db_config) as d:
+            self.db_config = json.load(d)
+        self.status_crawl = status_crawl
+
+        tables = self.run_queries(snapshot_path, snapshot_ttl)
+
+        self.atlas_eligibility_status = self.get_atlas_eligibility_status(tables['rnaseq_atlas_eligibility'],
+                                                                          tables['autosubs_atlas_fail_score'])
+        self.accession_urls = self.get_accession_urls(tables['bulk_experiments'], tables['sc_experiments'])
+        self.db_vs_crawler_check(tables['bulk_accessions'], tables['sc_accessions'])
+
+    def run_queries(self, snapshot_path=None, snapshot_ttl=0):
+        """
+        Reads every table in QUERIES once, concurrently, so the db crawl takes as long as the slowest query.
+        Returns query name -> dataframe.
+        """
+        cache = query_cache(snapshot_path, snapshot_ttl)
+        for db_name, table, columns in QUERIES.values():
+            cache.require(db_name, table, columns)
+
+        pool = connection_pool(self.db_config)
+        try:
+            cache.fetch(pool)
+        finally:
+            pool.close()
+
+        return OrderedDict((name, cache.get(*spec)) for name, spec in QUERIES.items())
+
+    @staticmethod
+    def get_columns(db, table, columns, batch_size=FETCH_BATCH_SIZE):
         """
         returns dataframe with specified columns given a db object and table
-        columns[0] taken as primary key
+        columns[0] taken as primary key, rows without one are dropped
+        Rows are fetched as tuples in batches and the dataframe is built column-wise.
+        Postgres uses a named (server-side) cursor so the result is streamed rather than held by the client.
         """
-        cursor = db.cursor()
+        if isinstance(db, psycopg.Connection):
+            cursor = db.cursor(name='get_columns_{}'.format(table))
+        else:
+            cursor = db.cursor()
         query = "SELECT {} FROM {}".format(', '.join(columns), table)
-        cursor.execute(query)
-        result = []
-        for row in cursor:
-            if row[0]:
-                result.append({k: row[idx] for idx, k in enumerate(columns)})
+        try:
+            cursor.execute(query)
+            values = [[] for _ in columns]
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                rows = [row for row in rows if row[0]]
+                for column_values, batch_values in zip(values, zip(*rows)):
+                    column_values.extend(batch_values)
+        finally:
+            cursor.close()
 
-        return pd.DataFrame(result).set_index(columns[0])
+        return pd.DataFrame(OrderedDict(zip(columns, values)), columns=columns).set_index(columns[0])
 
-    def db_vs_crawler_check(self):
+    def db_vs_crawler_check(self, bulk_experiments, sc_experiments):
         """
         Looks for accessions in production db that were not picked up in nfs crawl
         """
-        db = self.db_connect('gxpatlaspro')
-        logging.debug("bulk atlasprod connected")
-        bulk_access = self.get_columns(db, 'experiment', ['accession'])
-        bulk_access['bulk/sc'] = 'bulk'
-        logging.info("query to bulk atlasprod for experiments not found in nfs crawl")
-
-        db = self.db_connect('gxpscxapro')
-        logging.debug("single-cell atlasprod connected")
-        sc_access = self.get_columns(db, 'experiment', ['accession'])
-        sc_access['bulk/sc'] = 'sc'
-        logging.info("query to single-cell atlasprod for experiments not found in nfs crawl")
-
-        df = pd.concat([bulk_access, sc_access])  # data needed to construct url
-        db_accession_list = df.index.to_list()
+        db_accession_list = bulk_experiments.index.to_list() + sc_experiments.index.to_list()
         crawler_accessions_list = list(self.status_crawl.accession_final_status.keys())
         diff = [x for x in db_accession_list if x not in crawler_accessions_list]
         if len(diff) > 0:
             print('WARNING: {} accessions were found in production DB but were not picked up by crawler\n {}\nThese have not been added to the tracker.'.format(len(diff), str(diff)))
 
-    def get_accession_urls(self):
+    def get_accession_urls(self, bulk_experiments, sc_experiments):
         """
         returns click-through url for accession if the accession is published at www or wwwdev
         """
-        db = self.db_connect('gxpatlaspro')
-        logging.debug("bulk atlasprod connected")
-        bulk_access = self.get_columns(db, 'experiment', ['accession', 'private', 'access_key'])
-        bulk_access['bulk/sc'] = 'bulk'
-        logging.info("query to bulk atlasprod for urls")
-
-        db = self.db_connect('gxpscxapro')
-        logging.debug("single-cell atlasprod connected")
-        sc_access = self.get_columns(db, 'experiment', ['accession', 'private', 'access_key'])
-        sc_access['bulk/sc'] = 'sc'
-        logging.info("query to single-cell atlasprod for urls")
+        bulk_access = bulk_experiments.assign(**{'bulk/sc': 'bulk'})
+        sc_access = sc_experiments.assign(**{'bulk/sc': 'sc'})
 
         url_map_data = pd.concat([bulk_access, sc_access])  # data needed to construct url
 
@@ -139,19 +319,12 @@ class db_crawler:
 
         return url_map
 
-    def get_atlas_eligibility_status(self):
+    def get_atlas_eligibility_status(self, rnaseq_atlas_eligibility, autosubs_atlas_fail_score):
         """
         returns accession keyed dict with status
         """
-        db = self.db_connect('gxpatlaspro')
-        logging.debug("bulk atlasprod connected")
-        rnaseq_atlas_eligibility = self.get_columns(db, 'rnaseq_atlas_eligibility', ['ae2_acc', 'status']).rename(columns={"status": "eligibility_status"})
-        logging.info("query to bulk atlasprod for atlas eligibility")
-
-        db = self.db_connect('ae_autosubs')
-        logging.debug("autosubs connected")
-        autosubs_atlas_fail_score = self.get_columns(db, 'experiments', ['accession', 'atlas_fail_score']).rename(columns={"atlas_fail_score": "eligibility_status"})
-        logging.info("query to autosubs for atlas eligibility")
+        rnaseq_atlas_eligibility = rnaseq_atlas_eligibility.rename(columns={"status": "eligibility_status"})
+        autosubs_atlas_fail_score = autosubs_atlas_fail_score.rename(columns={"atlas_fail_score": "eligibility_status"})
 
         eligibility_dict_ = pd.concat([rnaseq_atlas_eligibility, autosubs_atlas_fail_score])['eligibility_status'].to_dict()
 
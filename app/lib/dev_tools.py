@@ -6,36 +6,38 @@ __license__ = "Apache 2.0"
 __date__ = "29/07/2019"
 
 import re
-import os
-from datetime import datetime
-import pickle
-from app.lib import statusCrawl
-
-def atlas_status_from_last_save():
-    log_path = '../workflows/logs/'
-    file_ending = '.atlas_status.log'
-    logs = os.listdir(log_path)
-    timestamps = []
-    for log in logs:
-        if log.endswith(file_ending):
-            timestamps.append(datetime.fromisoformat(log.rstrip(file_ending)).timestamp())
-    latest_pickle = str(datetime.fromtimestamp(max(timestamps)).isoformat()) + file_ending
-    with open(log_path + latest_pickle, 'rb') as f:
-        return pickle.load(f)
-
-def accessioner(prefix, sources_config=False, secondary_accession=False):
-
-    def counter_method(prefix, sources_config):
-        current_accession = 0
-        atlas_status = statusCrawl.atlas_status(sources_config, crawl=False) # partial fast crawl just for accessions
-        for accession in atlas_status.all_primary_accessions:
-            numeric_part = accession.split('-')[-1]
-            prefix_part = accession.split('-')[-2]
-            assert numeric_part.isdigit(), 'Accession parsing error parsing error'
-            if prefix_part == prefix and int(numeric_part) > current_accession:
-                current_accession = int(numeric_part)
-            new_accession = str(current_accession + 1)
-        return str('E-' + prefix + '-' + new_accession)
+import time
+from app.lib import accessionAllocator
+from app.lib import accessionLookup
+
+def atlas_status_from_last_save(snapshot_root='../workflows/logs/snapshots'):
+    """
+    Accession lookups from the latest run snapshot (see runSnapshot.py). Columns are read when first used.
+    """
+    from app.lib import runSnapshot  # imported here, dev_tools is loaded with the package and should not need pyarrow
+    return runSnapshot.saved_status(runSnapshot.latest_snapshot(snapshot_root))
+
+def db_table_from_last_save(db_name, table, columns, snapshot_path='../workflows/logs/db_snapshot.sqlite', ttl=None):
+    """
+    Reads a table saved by the last tracker run (see dbCrawl.query_cache) without connecting to production.
+    Only runs with --db_snapshot and --db_snapshot_ttl save tables, secret columns such as access_key are not saved.
+    columns[0] is the index. Raises if the table is missing from the snapshot or older than ttl seconds.
+    """
+    from app.lib import dbCrawl  # imported here, dev_tools is loaded with the package and should not need db drivers
+    cached = dbCrawl.read_snapshot(snapshot_path).get((db_name, table))
+    assert cached, '{}.{} is not in the db snapshot {}'.format(db_name, table, snapshot_path)
+    assert set(columns) <= set(cached['columns']), 'Columns {} are not all in the db snapshot of {}.{}'.format(columns, db_name, table)
+    age = time.time() - cached['fetched']
+    assert ttl is None or age < ttl, 'Db snapshot of {}.{} is {:.0f}s old'.format(db_name, table, age)
+    frame = cached['frame']
+    return frame.reset_index()[columns].set_index(columns[0])
+
+def accessioner(prefix, *, secondary_accession=False, marks_path='../workflows/logs/accession_marks.json'):
+    # counter prefixes are allocated from the marks kept by tracker runs, see accessionAllocator.py
+    # keyword only, a call still passing sources_config second fails instead of taking it as secondary_accession
+
+    def counter_method(prefix, marks_path):
+        return accessionAllocator.allocate(marks_path, prefix)[0]  # reserved under a file lock, see accessionAllocator.py
 
     def GEO_method(secondary_accession):
         'GEO series records are handles with bespoke conversion (GSExxx)'
@@ -53,8 +55,7 @@ def accessioner(prefix, sources_config=False, secondary_accession=False):
                                          'EHCA': 'counter_method'}
 
     if supported_prefix_for_accessioning.get(prefix) == 'counter_method':
-        assert sources_config, 'You must provide "sources_config" argument for this prefix type'
-        accession = counter_method(prefix, sources_config)
+        accession = counter_method(prefix, marks_path)
 
     elif supported_prefix_for_accessioning.get(prefix) == 'GEO_method':
         assert secondary_accession, 'You must provide "secondary_accession" argument for this prefix type'
@@ -70,57 +71,41 @@ def accessioner(prefix, sources_config=False, secondary_accession=False):
 
     return accession
 
-def external_duplication_check(external_accession):
-    # fails duplication check if internal accession is returned
-    # passes check if False is returned
-    atlas_status = atlas_status_from_last_save()
-
-
+def external_duplication_check(external_accession, lookup_path='../workflows/logs/accession_lookup.sqlite'):
+    # fails duplication check if an external (secondary or GEO) accession maps to an internal accession
+    # passes check if None is returned
     if type(external_accession) == str:
-        external_accession = list(external_accession)
-
-    def external_duplication_check(external_accession):  # check if we have already seen this secondary accession in all idfs we have in the source config locations
-
-        if external_accession in atlas_status.all_secondary_accessions:
-            for internal_accession, external_accession_list in atlas_status.secondary_accessions_mapping.items():
-                if external_accession in external_accession_list:
-                    return internal_accession
-                else:
-                    raise Exception(
-                        'This external accession ({}) is already being ingested but conversion to an internal accession was not possible'.format(
-                            external_accession))
-        else:
-            return False
-
-    for external_accession in external_accession:
-        external_dup_check = external_duplication_check(external_accession)
-        if external_dup_check:
+        external_accession = [external_accession]
+
+    found = accessionLookup.lookup(lookup_path, external_accession, kinds=('secondary', 'geo'))
+    for accession in external_accession:
+        if accession.strip() in found:
             raise ValueError(
                 'External accession {} has already been ingested into atlas. See internal accession {}.'.format(
-                    external_accession, external_dup_check))
+                    accession, ', '.join(sorted(set(x[1] for x in found[accession.strip()])))))
 
-def internal_duplication_check(accessions):
+def internal_duplication_check(accessions, lookup_path='../workflows/logs/accession_lookup.sqlite'):
     if type(accessions) == str:
-        external_accession = list(accessions)
-    atlas_status = atlas_status_from_last_save()
+        accessions = [accessions]
+    found = accessionLookup.lookup(lookup_path, accessions, kinds=('primary',))
     for accession in accessions:
-        if accession in atlas_status.all_primary_accessions:
+        if accession.strip() in found:
             raise ValueError(
                 'Internal accession {} has already been ingested into atlas.'.format(accession))
 
-def get_ae_metadata_files(external_accession, sources_config):
+def get_ae_metadata_files(external_accession):
     if type(external_accession) == str:
-        external_accession = list(external_accession)
+        external_accession = [external_accession]
 
     # atlas_status = status_crawler.atlas_status(sources_config, crawl=False)
     atlas_status = atlas_status_from_last_save()
     idf_path_by_accession = {}
     sdrf_path_by_accession = {}
     for accession in external_accession:
-        idf_path = atlas_status.idf_path_by_accession.get(accession, False)
-        sdrf_path = atlas_status.sdrf_path_by_accession.get(accession, False)
-        assert idf_path != None, 'IDF file could not be found for accession {}. This dataset cannot be imported.'.format(accession)
-        assert sdrf_path != None, 'SDRF file could not be found for accession {}. This dataset cannot be imported.'.format(accession)
+        idf_path = atlas_status.idf_path_by_accession.get(accession)
+        sdrf_path = atlas_status.sdrf_path_by_accession.get(accession)
+        assert idf_path, 'IDF file could not be found for accession {}. This dataset cannot be imported.'.format(accession)
+        assert sdrf_path, 'SDRF file could not be found for accession {}. This dataset cannot be imported.'.format(accession)
         idf_path_by_accession[accession] = idf_path
         sdrf_path_by_accession[accession] = sdrf_path
     return {'idf paths': idf_path_by_accession, 'sdrf paths':sdrf_path_by_accession}
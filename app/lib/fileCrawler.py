@@ -6,30 +6,179 @@ __author__ = "hewgreen"
 __license__ = "Apache 2.0"
 __date__ = "08/11/2019"
 
-import glob
 from datetime import datetime
 from tqdm import tqdm
 import re
 import os
 import json
 import collections
+import itertools
 import numpy as np
 import sys
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from app.lib import parseCache
+
+
+IDF_QUERY = {'Experiment Type': re.compile(r'Comment\[EAExperimentType\]|Comment \[EAExperimentType\]'),
+             'Curator': re.compile(r'Comment\[EACurator\]|Comment \[EACurator\]'),
+             'Analysis Type': re.compile(r'Comment\[AEExperimentType\]|Comment \[AEExperimentType\]'),
+             'Investigation Title': re.compile(r'Investigation Title'),
+             'Secondary Accession': re.compile(r'Comment \[SecondaryAccession\]|Comment\[SecondaryAccession\]')
+             }
+
+SDRF_QUERY = {
+    'Single-cell Experiment Type': re.compile(r'Comment\[library construction\]|Comment \[library construction\]'),
+    'Organism': re.compile(r'Characteristics\[organism\]|Characteristics \[organism\]|Characteristics \[Organism\]|Characteristics\[Organism\]')
+    }
+
+# pattern 1 extracts row based on first column
+# pattern 2 parses value from pattern 1 match
+ANALYSIS_QUERY = {
+    'GeneQuant': (re.compile(r'Gene Quantification|Quantification'),
+                      {'GeneQuantSoft': re.compile('^(.*)(?= version)'),
+                       'GQSVersion': re.compile('(?<=version: )(.*)$')
+                       }),
+    'TransQuant': (re.compile(r'Transcript Quantification'),
+                      {'TransQuantSoft': re.compile('^(.*)(?= version)'),
+                       'TQSVersion': re.compile('(?<=version: )(.*)$')
+                       }),
+    'Mapping': (re.compile(r'Read Mapping'),
+                        {'MappingSoft': re.compile('\) (.*) version'),
+                        'MappingSoftVersion': re.compile('(?<=\) )(.*)(?= version)'),
+                        'E!Version': re.compile('(?<=Ensembl Genomes release: )(.*)(?=\))')
+                        })
+    }
+
+
+def combined_matcher(query):
+    '''
+    Folds the per key patterns into one regex with a named group per output key so the first field of a line is
+    classified against every key in a single match. Group names are positional as output keys are not identifiers.
+    '''
+    groups = {'k{}'.format(i): output_key for i, output_key in enumerate(query)}
+    pattern = re.compile('|'.join('(?P<k{}>{})'.format(i, p.pattern) for i, p in enumerate(query.values())))
+    return pattern, groups
+
+
+IDF_MATCHER, IDF_GROUPS = combined_matcher(IDF_QUERY)
+
+
+def file_reader(filename, max_lines=None):
+    '''
+    Includes non utf-8 handling: strips unknown characters often in pup title
+    Returns the split lines (None for empty files) and whether non utf-8 characters were stripped.
+    max_lines stops reading early for files where only the head is used.
+    '''
+    unicode_error = False
+    try:
+        with open(filename, mode='r', newline='') as s:  # strict text handling
+            fileContent = [x.rstrip().split('\t') for x in itertools.islice(s, max_lines)]
+    except UnicodeDecodeError:
+        unicode_error = True
+        with open(filename, mode='rb') as s:  # strip non utf-8
+            fileContent = [x.decode('utf-8', 'ignore').rstrip().split('\t') for x in itertools.islice(s, max_lines)]
+
+    if len(fileContent) <= 1:  # defend against empty files
+        return None, unicode_error
+    else:
+        return fileContent, unicode_error
+
+
+def stream_first_matches(filename, matcher, groups):
+    '''
+    Streams a file line by line keeping the first line matched for each key (entire row minus the first field).
+    Stops reading as soon as every key has been found so large idfs are not read to the end.
+    Returns None for empty files (one line or less) like file_reader.
+    '''
+
+    def scan(lines):
+        fields = {}
+        line_count = 0
+        for x in lines:
+            line_count += 1
+            line = x.rstrip().split('\t')
+            m = matcher.match(line[0])
+            if m and groups[m.lastgroup] not in fields:
+                # take multiple rows if they are present.
+                result = line[1:]
+                fields[groups[m.lastgroup]] = result if result else np.nan
+                if len(fields) == len(groups) and line_count > 1:
+                    break
+        return fields, line_count
+
+    unicode_error = False
+    try:
+        with open(filename, mode='r', newline='') as s:  # strict text handling
+            fields, line_count = scan(s)
+    except UnicodeDecodeError:
+        unicode_error = True
+        with open(filename, mode='rb') as s:  # strip non utf-8, rescan from the start
+            fields, line_count = scan(x.decode('utf-8', 'ignore') for x in s)
+
+    if line_count <= 1:  # defend against empty files
+        return None, unicode_error
+    return fields, unicode_error
+
+
+def parse_idf(filename):
+    # extracts entire row as a list
+    fields, unicode_error = stream_first_matches(filename, IDF_MATCHER, IDF_GROUPS)
+    return dict(fields=fields or {}, unicode_error=unicode_error, empty=fields is None)
+
+
+def parse_sdrf(filename):
+    # extracts 1st value form 1st row only, the rest of the file is not read
+    fileContent, unicode_error = file_reader(filename, max_lines=2)
+    fields = {}
+    if fileContent:
+        for output_key, p in SDRF_QUERY.items():
+            hits = [ind for ind, x in enumerate(fileContent[0]) if re.match(p, x)]
+            if hits:
+                fields[output_key] = ' & '.join([fileContent[1][x] for x in hits])  # extract value from 1st row only
+    return dict(fields=fields, unicode_error=unicode_error, empty=fileContent is None)
+
+
+def parse_analysis(filename):
+    fileContent, unicode_error = file_reader(filename)
+    fields = {}
+    for key, p in ANALYSIS_QUERY.items():
+        if fileContent:
+            for line in fileContent:
+                if re.match(p[0], line[0]):
+                    try:
+                        v_str = line[1]
+                    except IndexError:
+                        continue
+
+                    for output_key, pat in p[1].items():
+                        v_search = pat.search(v_str)
+                        if v_search:
+                            fields[output_key] = v_search.group(1)
+    return dict(fields=fields, unicode_error=unicode_error, empty=fileContent is None)
 
 
 class file_crawler:
 
-    def __init__(self, status_crawl, sources_config):
+    def __init__(self, status_crawl, sources_config, cache_path=None, rebuild_cache=False, workers=1, pool='thread'):
 
         # configuration
         with open(sources_config) as f:
             self.sources_config = json.load(f)
         self.status = status_crawl
+        assert pool in ('thread', 'process'), 'Unknown pool type {}. Use "thread" or "process".'.format(pool)
+        self.workers = workers
+        self.pool = pool
+
+        # optional on-disk cache of parsed files, see parseCache.py
+        self.parse_cache = parseCache.parse_cache(cache_path, rebuild=rebuild_cache) if cache_path else None
 
         self.unicode_error_paths = []
         self.emptyfile_error_paths = []
         self.extracted_metadata = self.idf_sdrf_metadata_scraper()
 
+        if self.parse_cache:
+            self.parse_cache.save()
+
         self.curators_by_acession = self.lookup_curator_file()
         self.mod_time = self.get_file_modified_date()
 
@@ -44,126 +193,13 @@ class file_crawler:
 
     def idf_sdrf_metadata_scraper(self):
         '''
-        Includes non utf-8 handling: strips unknown characters often in pup title
         Fast method: reads metadata approximately (return first find) for speed improvements
         Strategy assumes search is slowest aspect.
         10x faster than pandas read methods.
         10x faster than string match methods.
+        Unchanged files are served from the parse cache when one is configured.
         '''
 
-        def file_reader(filename):
-            try:
-                with open(filename, mode='r', newline='') as s:  # strict text handling
-                    fileContent = [x.rstrip().split('\t') for x in list(s)]
-            except UnicodeDecodeError:
-                self.unicode_error_paths.append(filename)
-                with open(filename, mode='rb') as s:  # strip non utf-8
-                    fileContent = [x.decode('utf-8', 'ignore').rstrip().split('\t') for x in list(s)]
-
-            if len(fileContent) <= 1:  # defend against empty files
-                self.emptyfile_error_paths.append(filename)
-                return None
-            else:
-                return fileContent
-
-        def idf_extract():
-            # extracts entire row as a list
-
-            print('\nExtracting metadata from idf files...\n')
-            query = {'Experiment Type': re.compile(r'Comment\[EAExperimentType\]|Comment \[EAExperimentType\]'),
-                            'Curator': re.compile(r'Comment\[EACurator\]|Comment \[EACurator\]'),
-                            'Analysis Type': re.compile(r'Comment\[AEExperimentType\]|Comment \[AEExperimentType\]'),
-                            'Investigation Title': re.compile(r'Investigation Title'),
-                            'Secondary Accession': re.compile(r'Comment \[SecondaryAccession\]|Comment\[SecondaryAccession\]')
-                            }
-
-            extracted_metadata = collections.defaultdict(dict)
-
-            for accession, filename in tqdm(self.status.idf_path_by_accession.items(), unit='idf files'):
-                fileContent = file_reader(filename)
-                for output_key, p in query.items():
-                    if fileContent:
-                        for line in fileContent:
-                            if re.match(p, line[0]):
-                                try:
-                                    # take multiple rows if they are present.
-                                    result = line[1:]
-                                    if len(result) == 0:
-                                        v = np.nan
-                                    else:
-                                        v = result
-                                except IndexError:
-                                    continue
-                                extracted_metadata[output_key].update({accession: v})
-                                break
-            return extracted_metadata
-
-        def sdrf_extract():
-            # extracts 1st value form 1st row only
-
-            print('\nExtracting metadata from sdrf files...\n')
-            query = {
-                'Single-cell Experiment Type': re.compile(r'Comment\[library construction\]|Comment \[library construction\]'),
-                'Organism': re.compile(r'Characteristics\[organism\]|Characteristics \[organism\]|Characteristics \[Organism\]|Characteristics\[Organism\]')
-                }
-
-            extracted_metadata = collections.defaultdict(dict)
-
-            for accession, filename in tqdm(self.status.sdrf_path_by_accession.items(), unit='sdrf files'):
-                fileContent = file_reader(filename)
-                if fileContent:
-                    for output_key, p in query.items():
-                        hits = [ind for ind, x in enumerate(fileContent[0]) if re.match(p, x)]
-                        if hits:
-                            v = ' & '.join([fileContent[1][x] for x in hits]) # extract value from 1st row only
-                            extracted_metadata[output_key].update({accession: v})
-
-
-            return extracted_metadata
-
-
-        def analysis_extract():
-            print('\nExtracting metadata from analysis-methods files...\n')
-
-            # pattern 1 extracts row based on first column
-            # pattern 2 parses value from pattern 1 match
-            query = {
-                'GeneQuant': (re.compile(r'Gene Quantification|Quantification'),
-                                  {'GeneQuantSoft': re.compile('^(.*)(?= version)'),
-                                   'GQSVersion': re.compile('(?<=version: )(.*)$')
-                                   }),
-                'TransQuant': (re.compile(r'Transcript Quantification'),
-                                  {'TransQuantSoft': re.compile('^(.*)(?= version)'),
-                                   'TQSVersion': re.compile('(?<=version: )(.*)$')
-                                   }),
-                'Mapping': (re.compile(r'Read Mapping'),
-                                    {'MappingSoft': re.compile('\) (.*) version'),
-                                    'MappingSoftVersion': re.compile('(?<=\) )(.*)(?= version)'),
-                                    'E!Version': re.compile('(?<=Ensembl Genomes release: )(.*)(?=\))')
-                                    })
-                }
-
-            extracted_metadata = collections.defaultdict(dict)
-
-            for accession, filename in tqdm(self.status.analysis_path_by_accession.items(), unit='analysis files'):
-                fileContent = file_reader(filename)
-                for key, p in query.items():
-                    if fileContent:
-                        for line in fileContent:
-                            if re.match(p[0], line[0]):
-                                try:
-                                    v_str = line[1]
-                                except IndexError:
-                                    continue
-
-                                for output_key, pat in p[1].items():
-                                    v_search = pat.search(v_str)
-                                    if v_search:
-                                        v = v_search.group(1)
-                                        extracted_metadata[output_key].update({accession: v})
-            return extracted_metadata
-
-
         def merge_defaultdicts(d, d1):
             for k, v in d1.items():
                 if (k in d):
@@ -172,36 +208,103 @@ class file_crawler:
                     d[k] = d1[k]
             return d
 
-        extracted_analysis_metadata = analysis_extract()
-        extracted_idf_metadata = idf_extract()
-        extracted_sdrf_metadata = sdrf_extract()
+        print('\nExtracting metadata from analysis-methods files...\n')
+        extracted_analysis_metadata = self.extract('analysis', self.status.analysis_path_by_accession, parse_analysis)
+        print('\nExtracting metadata from idf files...\n')
+        extracted_idf_metadata = self.extract('idf', self.status.idf_path_by_accession, parse_idf)
+        print('\nExtracting metadata from sdrf files...\n')
+        extracted_sdrf_metadata = self.extract('sdrf', self.status.sdrf_path_by_accession, parse_sdrf)
         extracted_metadata = merge_defaultdicts(merge_defaultdicts(extracted_idf_metadata, extracted_sdrf_metadata), extracted_analysis_metadata)
 
         return extracted_metadata
 
+    def parse_files(self, kind, filenames, parser):
+        '''
+        Returns one record per filename, in the same order as filenames.
+        Cache lookups happen here in the calling thread, only cache misses are handed to the worker pool.
+        '''
+        records = [None] * len(filenames)
+        signatures = {}
+        pending = []
+        for i, filename in enumerate(filenames):
+            if self.parse_cache:
+                signatures[i] = self.parse_cache.signature(filename, getattr(filename, 'stat', None))
+                records[i] = self.parse_cache.get(kind, filename, signatures[i])
+            if records[i] is None:
+                pending.append(i)
+
+        parsed = self.map_parser(parser, [filenames[i] for i in pending], kind)
+        for i, record in zip(pending, parsed):
+            records[i] = record
+            if self.parse_cache:
+                self.parse_cache.put(kind, filenames[i], signatures[i], record)
+        return records
+
+    def map_parser(self, parser, filenames, kind):
+        '''
+        Most of the parse time is spent waiting on nfs reads so threads are the default.
+        Results are returned in input order whichever pool is used.
+        '''
+        progress = dict(total=len(filenames), unit='{} files'.format(kind))
+        if self.workers <= 1 or len(filenames) <= 1:
+            return list(tqdm(map(parser, filenames), **progress))
+
+        if self.pool == 'process':
+            executor = ProcessPoolExecutor(max_workers=self.workers)
+            chunksize = max(1, len(filenames) // (self.workers * 4))
+        else:
+            executor = ThreadPoolExecutor(max_workers=self.workers)
+            chunksize = 1
+        with executor:
+            return list(tqdm(executor.map(parser, filenames, chunksize=chunksize), **progress))
+
+    def extract(self, kind, path_by_accession, parser):
+        '''
+        Returns output key -> accession -> value for every file of one kind.
+        Error bookkeeping is done here after parsing so the order of the error lists does not depend on the pool.
+        '''
+        extracted_metadata = collections.defaultdict(dict)
+
+        items = list(path_by_accession.items())
+        records = self.parse_files(kind, [filename for accession, filename in items], parser)
+
+        for (accession, filename), record in zip(items, records):
+            if record['unicode_error']:
+                self.unicode_error_paths.append(filename)
+            if record['empty']:
+                self.emptyfile_error_paths.append(filename)
+            for output_key, v in record['fields'].items():
+                extracted_metadata[output_key].update({accession: v})
+
+        return extracted_metadata
+
     def lookup_curator_file(self):
         curator_signature = {}
-        for path, info in self.sources_config.items():
-            for file in glob.glob(path + '/E-*/.curator.*'):
+        for path, manifest in self.status.manifests.items():
+            for file in manifest.curator_files:
                 curator = file.split('.')[-1]
                 accession = file.split('/')[-2]
                 curator_signature[accession] = curator
         return curator_signature
 
     def get_file_modified_date(self):
+        '''
+        Uses the mtime captured during the crawl (see fsWalk.path_record), only stat'ing paths that lack one.
+        '''
         print("Getting datestamp of project's last modification {}".format(
             datetime.fromtimestamp(datetime.now().timestamp()).isoformat()))
+
+        def get_mtime(path):
+            mtime = getattr(path, 'mtime', None)
+            return mtime if mtime is not None else os.path.getmtime(path)
+
         mod_time = {}
         for accession, idf_path in self.status.idf_path_by_accession.items():
             sdrf_path = self.status.sdrf_path_by_accession.get(accession)
             if idf_path and sdrf_path:
-                idf_mode_time = os.path.getmtime(idf_path)
-                sdrf_mode_time = os.path.getmtime(sdrf_path)
-                mod_time[accession] = datetime.fromtimestamp(max(idf_mode_time, sdrf_mode_time)).isoformat()
+                mod_time[accession] = datetime.fromtimestamp(max(get_mtime(idf_path), get_mtime(sdrf_path))).isoformat()
             elif idf_path:
-                idf_mode_time = os.path.getmtime(idf_path)
-                mod_time[accession] = datetime.fromtimestamp(idf_mode_time).isoformat()
+                mod_time[accession] = datetime.fromtimestamp(get_mtime(idf_path)).isoformat()
             elif sdrf_path:
-                sdrf_mode_time = os.path.getmtime(sdrf_path)
-                mod_time[accession] = datetime.fromtimestamp(sdrf_mode_time).isoformat()
+                mod_time[accession] = datetime.fromtimestamp(get_mtime(sdrf_path)).isoformat()
         return mod_time
@@ -0,0 +1,146 @@
+'''
+single pass nfs walker shared by the crawl stages
+
+Each source root in sources_config is listed once with os.scandir (root plus one level of accession dirs).
+The resulting manifest holds the top level entries, idf/sdrf/analysis-methods/curator files and stat results
+so statusCrawl and fileCrawler do not need to list the same directories again with glob.
+run_with_deadlines crawls the sources concurrently, each with its own deadline.
+'''
+__author__ = "agent"
+__license__ = "Apache 2.0"
+__date__ = "17/10/2026"
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class path_record(str):
+    '''
+    Path string carrying the stat result taken when the file was discovered (None if stat failed).
+    Behaves as a plain path everywhere else. Consumers read mtime/size from it instead of stat'ing nfs again.
+    '''
+
+    def __new__(cls, path, stat=None):
+        record = str.__new__(cls, path)
+        record.stat = stat
+        return record
+
+    @property
+    def mtime(self):
+        return self.stat.st_mtime if self.stat else None
+
+    @property
+    def size(self):
+        return self.stat.st_size if self.stat else None
+
+
+class source_manifest:
+
+    def __init__(self, root):
+        self.root = root
+        self.entries = []  # names directly under root, as os.listdir would return them
+        self.accession_dirs = []
+        self.idf_files = []
+        self.sdrf_files = []
+        self.analysis_files = []
+        self.curator_files = []
+
+    @staticmethod
+    def add_metadata_file(entry, file_list):
+        # idf/sdrf/analysis files are kept as path_record with their stat result
+        try:
+            stat = entry.stat()
+        except OSError:  # e.g. broken symlink, left for the consumer to handle
+            stat = None
+        file_list.append(path_record(entry.path, stat))
+
+
+def scan_source(root):
+    '''
+    Matches the glob patterns previously used per stage:
+    <root>/*idf.txt <root>/*sdrf.txt <root>/*-analysis-methods.tsv
+    <root>/*/*idf.txt <root>/*/*sdrf.txt <root>/*/*analysis-methods.tsv <root>/E-*/.curator.*
+    Hidden entries are skipped like glob does except for the explicit .curator.* pattern.
+    Files found one level down are listed before those in the root to keep the previous ordering.
+    '''
+    manifest = source_manifest(root)
+    top_idf, top_sdrf, top_analysis = [], [], []
+
+    with os.scandir(root) as it:
+        top_entries = list(it)
+
+    for entry in top_entries:
+        manifest.entries.append(entry.name)
+        if entry.name.startswith('.'):
+            continue
+        if entry.is_dir():
+            manifest.accession_dirs.append(entry.path)
+            scan_accession_dir(manifest, entry)
+        elif entry.name.endswith('idf.txt'):
+            manifest.add_metadata_file(entry, top_idf)
+        elif entry.name.endswith('sdrf.txt'):
+            manifest.add_metadata_file(entry, top_sdrf)
+        elif entry.name.endswith('-analysis-methods.tsv'):
+            manifest.add_metadata_file(entry, top_analysis)
+
+    manifest.idf_files += top_idf
+    manifest.sdrf_files += top_sdrf
+    manifest.analysis_files += top_analysis
+    return manifest
+
+
+def scan_accession_dir(manifest, dir_entry):
+    try:
+        with os.scandir(dir_entry.path) as it:
+            entries = list(it)
+    except (PermissionError, NotADirectoryError, FileNotFoundError):  # glob silently skips unreadable dirs
+        return
+
+    for entry in entries:
+        if entry.name.startswith('.curator.') and dir_entry.name.startswith('E-'):
+            manifest.curator_files.append(entry.path)
+        elif entry.name.startswith('.'):
+            continue
+        elif entry.name.endswith('idf.txt'):
+            manifest.add_metadata_file(entry, manifest.idf_files)
+        elif entry.name.endswith('sdrf.txt'):
+            manifest.add_metadata_file(entry, manifest.sdrf_files)
+        elif entry.name.endswith('analysis-methods.tsv'):
+            manifest.add_metadata_file(entry, manifest.analysis_files)
+
+
+def run_with_deadlines(tasks, timeouts):
+    '''
+    Runs each task (name -> callable) in its own thread, all started together, and waits for each up to its
+    timeout in seconds (name -> seconds, None waits indefinitely).
+    Returns name -> dict(status='ok'|'error'|'degraded', result, error, latency).
+    A task still running at its deadline is reported as degraded and abandoned. Threads blocked on a hung mount
+    cannot be cancelled, they are daemon threads so they do not keep the process alive.
+    '''
+    outcomes = OrderedDict()
+    finished = {name: threading.Event() for name in tasks}
+
+    def runner(name, task):
+        start = time.monotonic()
+        try:
+            outcome = dict(status='ok', result=task(), error=None)
+        except Exception as e:
+            outcome = dict(status='error', result=None, error=e)
+        outcome['latency'] = time.monotonic() - start
+        outcomes.setdefault(name, outcome)  # ignored if the deadline already passed
+        finished[name].set()
+
+    start = time.monotonic()
+    for name, task in tasks.items():
+        threading.Thread(target=runner, args=(name, task), name='crawl {}'.format(name), daemon=True).start()
+
+    for name in tasks:
+        timeout = timeouts.get(name)
+        remaining = None if timeout is None else max(0, start + timeout - time.monotonic())
+        if not finished[name].wait(remaining):
+            outcomes.setdefault(name, dict(status='degraded', result=None, error=None,
+                                           latency=time.monotonic() - start))
+
+    return OrderedDict((name, outcomes[name]) for name in tasks)
@@ -2,6 +2,9 @@
 writes out and formats summary dataframe to google sheets using google sheet API
 
 Output goes here https://docs.google.com/spreadsheets/d/13gxKodyl-zJTeyCxXtxdw_rp60WJHMcHLtZhxhg5opo/edit#gid=736620111
+
+All frames are written together through one sheets service: one metadata read, one batchUpdate for new tabs and row
+changes, the values in paced chunks (see sheetWriter) and one batchUpdate for formatting and removing old tabs.
 '''
 __author__ = "hewgreen"
 __license__ = "Apache 2.0"
@@ -9,51 +12,223 @@ __date__ = "01/08/2019"
 
 import gspread
 from oauth2client.service_account import ServiceAccountCredentials
-import gspread_dataframe
 from datetime import datetime
 from googleapiclient import discovery
-import time
+from app.lib import outputFormat
+from app.lib import sheetDelta
+from app.lib import sheetWriter
+from collections import OrderedDict
+
+
+class sheets_client:
+    '''
+    Single sheets v4 service reused for every call of a run. Counts round trips to the api.
+    endpoint points the service at another host, e.g. a local fake of the sheets api.
+    Calls are made once, retries and pacing are left to sheetWriter.chunked_writer.
+    '''
+
+    def __init__(self, credentials, endpoint=None):
+        client_options = {'api_endpoint': endpoint} if endpoint else None
+        self.service = discovery.build('sheets', 'v4', credentials=credentials, cache_discovery=False,
+                                       client_options=client_options)
+        self.round_trips = 0
+
+    def execute(self, request):
+        self.round_trips += 1
+        return request.execute()
+
+    def get_sheets(self, spreadsheet_id):
+        '''
+        returns sheetId -> sheet properties (title, gridProperties) for every tab in the spreadsheet
+        '''
+        fields = 'sheets(properties(sheetId,title,gridProperties(rowCount,columnCount)))'
+        metadata = self.execute(self.service.spreadsheets().get(spreadsheetId=spreadsheet_id, fields=fields))
+        return OrderedDict((x['properties']['sheetId'], x['properties']) for x in metadata.get('sheets', []))
+
+    def batch_update(self, spreadsheet_id, requests):
+        if requests:
+            self.execute(self.service.spreadsheets().batchUpdate(spreadsheetId=spreadsheet_id,
+                                                                 body={'requests': requests}))
 
-def google_sheet_output(google_client_secret, output_dfs, spreadsheetname):
+    def values_batch_get(self, spreadsheet_id, ranges):
+        '''
+        returns the rows of each range, in the order of ranges
+        '''
+        if not ranges:
+            return []
+        response = self.execute(self.service.spreadsheets().values().batchGet(spreadsheetId=spreadsheet_id,
+                                                                              ranges=ranges, majorDimension='ROWS'))
+        return [x.get('values', []) for x in response.get('valueRanges', [])]
+
+    def values_batch_update(self, spreadsheet_id, data):
+        if data:
+            self.execute(self.service.spreadsheets().values().batchUpdate(
+                spreadsheetId=spreadsheet_id, body={'valueInputOption': 'USER_ENTERED', 'data': data}))
+
+
+def google_sheet_output(google_client_secret, output_dfs, spreadsheetname, mode='full', snapshot_dir=None,
+                        progress_path=None, endpoint=None, spreadsheet_id=None, writer_options=None):
+    '''
+    mode='full' writes every frame to a new timestamped worksheet and deletes the old ones.
+    mode='delta' compares each frame with the copy last published from snapshot_dir and only sends changed, added
+    and removed rows to the existing worksheet, frames that did not change are not uploaded at all.
+    Delta falls back to a full write when there is no snapshot, the columns changed, the worksheet was removed or
+    its key column (A) no longer matches the snapshot, e.g. after a curator sorted the sheet or edited an accession.
+    The key columns of all worksheets are read in one call before any delta is applied.
+
+    Upload progress is kept in progress_path. After an interrupted upload the next call reuses the tabs it created
+    and skips value chunks that were already written.
+
+    endpoint sends every sheets api call to another host, e.g. the local fake in app/benchmarks/fake_sheets.py.
+    spreadsheet_id skips looking the spreadsheet up by name, without a client secret anonymous credentials are used
+    (only useful with such an endpoint). writer_options are passed to sheetWriter.chunked_writer.
+    '''
 
     print('Outputting to google sheet {}'.format(datetime.fromtimestamp(datetime.now().timestamp()).isoformat()))
     scope = ['https://spreadsheets.google.com/feeds',
              'https://www.googleapis.com/auth/drive']
-    creds = ServiceAccountCredentials.from_json_keyfile_name(google_client_secret, scope)
-    client = gspread.authorize(creds)
-    spreadsheet = client.open(spreadsheetname)  # this is the spreadsheet not the worksheet
+    if google_client_secret:
+        creds = ServiceAccountCredentials.from_json_keyfile_name(google_client_secret, scope)
+    else:
+        from google.auth.credentials import AnonymousCredentials
+        creds = AnonymousCredentials()
+    if spreadsheet_id is None:
+        client = gspread.authorize(creds)
+        spreadsheet_id = client.open(spreadsheetname).id  # this is the spreadsheet not the worksheet
+    sheets = sheets_client(creds, endpoint=endpoint)
+    writer = sheetWriter.chunked_writer(sheets, spreadsheet_id, **(writer_options or {}))
+    progress = sheetWriter.upload_progress(progress_path, spreadsheet_id)
+    existing = writer.call(sheets.get_sheets, spreadsheet_id)
+    next_sheet_id = max(existing) + 1 if existing else 1
 
+    structure = []  # new tabs and row deletions/additions, before values are written
+    blocks = []  # (tab title, first row, rows) of values
+    finish = []  # formatting of new tabs and removal of old tabs, after values are written
     keep_sheets = []
+    new_tabs = {}
+    snapshots = []  # written once the upload went through
+
+    frames = OrderedDict((title, outputFormat.normalise_missing(df)) for title, df in output_dfs.items())  # None/NaN written as empty cells
+    deltas = {}  # title -> (snapshot path, table, published snapshot, sheet) of frames written as a delta
+    edited = set()
+    if mode == 'delta':
+        for title, df in frames.items():
+            path = sheetDelta.snapshot_path(snapshot_dir, spreadsheetname, title)
+            table = sheetDelta.sheet_table(df)
+            published = sheetDelta.read_snapshot(path)
+            deltas[title] = (path, table, published, published_sheet(existing, published, table))
+        candidates = [title for title, x in deltas.items() if x[3] is not None]
+        key_columns = writer.call(sheets.values_batch_get, spreadsheet_id,
+                                  ["'{}'!A:A".format(deltas[title][3]['title'].replace("'", "''")) for title in candidates])
+        for title, key_column in zip(candidates, key_columns):
+            path, table, published, sheet = deltas[title]
+            if not keys_match(key_column, published):
+                print('{}: worksheet was edited since it was published, writing in full'.format(title))
+                deltas[title] = (path, table, published, None)
+                edited.add(title)
 
-    for title, df in output_dfs.items():
-        # add new empty worksheet
-        sheetname = '{} {}'.format(title, datetime.now())
-        keep_sheets.append(sheetname)
-
-        spreadsheet.add_worksheet(title=sheetname, rows=df.shape[0] + 1, cols=df.shape[1] + 1)
-        # fill new empty worksheet
-        try:
-            gspread_dataframe.set_with_dataframe(spreadsheet.worksheet(sheetname), df, include_index=True, include_column_header=True)
-        # except gspread.exceptions.APIError: # I've seen this error and socket timeout error. Catching all for now.
-        except:
-            time.sleep(60)
-            print('Hit Google API error. Waiting 1 min then retrying...')
-            try:
-                gspread_dataframe.set_with_dataframe(spreadsheet.worksheet(sheetname), df, include_index=True,include_column_header=True)
-            except:
-                time.sleep(600)
-                print('Hit Google API error. Waiting 10 min then retrying...')
-                gspread_dataframe.set_with_dataframe(spreadsheet.worksheet(sheetname), df, include_index=True,include_column_header=True)
-
-        post_sheet_formatting(credentials=creds, spreadsheet_id=spreadsheet.id,sheetId=spreadsheet.worksheet(sheetname).id)
+    for title, df in frames.items():
+        if mode == 'delta':
+            path, table, published, sheet = deltas[title]
+            if sheet is not None:
+                requests, sheet_blocks = delta_requests(sheet, published, table, title)
+                structure += requests
+                blocks += sheet_blocks
+                keep_sheets.append(sheet['sheetId'])
+                snapshots.append((path, table, sheet['sheetId']))
+                continue
+            if title not in edited:
+                print('{}: no usable snapshot of the published sheet, writing in full'.format(title))
+
+        # new worksheet, filled and formatted in the batches below. A tab left by an interrupted upload is reused.
+        grid = {"rowCount": df.shape[0] + 1, "columnCount": df.shape[1] + 1}
+        tab = progress.tabs.get(title)
+        if tab is None or existing.get(tab['sheetId']) != tab:
+            tab = {"sheetId": next_sheet_id, "title": '{} {}'.format(title, datetime.now()), "gridProperties": grid}
+            next_sheet_id += 1
+            structure.append({"addSheet": {"properties": tab}})
+        elif tab['gridProperties'] != grid:
+            structure.append({"updateSheetProperties": {"properties": {"sheetId": tab['sheetId'], "gridProperties": grid},
+                                                        "fields": "gridProperties(rowCount,columnCount)"}})
+            tab = dict(tab, gridProperties=grid)
+        new_tabs[title] = tab
+        blocks.append((tab['title'], 0, sheetDelta.frame_values(df)))
+        finish += sheet_formatting_requests(tab['sheetId'])
+        keep_sheets.append(tab['sheetId'])
+        if mode == 'delta' and table is not None:
+            snapshots.append((path, table, tab['sheetId']))
 
     # remove old worksheets
-    for sheet in spreadsheet.worksheets():
-        title = sheet.title
-        if title not in keep_sheets:
-            spreadsheet.del_worksheet(spreadsheet.worksheet(title))
+    finish += [{"deleteSheet": {"sheetId": x}} for x in existing if x not in keep_sheets]
+
+    # row deletions/additions are not safe to repeat, only retried when rejected by quota
+    writer.call(sheets.batch_update, spreadsheet_id, structure, idempotent=False)
+    progress.tabs = new_tabs
+    progress.save()
+    writer.write_values(blocks, progress)
+    writer.call(sheets.batch_update, spreadsheet_id, finish, idempotent=False)
+
+    for path, table, sheet_id in snapshots:
+        sheetDelta.write_snapshot(path, table, sheet_id)
+    progress.clear()
+    print('Google sheet written in {} sheets api round trips ({} retries)'.format(sheets.round_trips, writer.retries))
+
+
+def published_sheet(existing, published, table):
+    '''
+    Returns the properties of the tab holding the published snapshot if a delta can be applied to it, otherwise None.
+    The tab must still exist with the same columns and the row count it was left with, and keep at least one row.
+    '''
+    if published is None or table is None or not table['keys'] or published['header'] != table['header']:
+        return None
+    sheet = existing.get(published['sheet_id'])
+    if sheet is None or sheet['gridProperties']['rowCount'] != len(published['keys']) + 1:
+        return None
+    return sheet
+
+
+def keys_match(key_column, published):
+    '''
+    True if the key column read from the sheet (rows of column A, header first) is the published header and keys
+    '''
+    values = [str(row[0]) if row else '' for row in key_column]
+    expected = [str(published['header'][0])] + published['keys']
+    return values + [''] * (len(expected) - len(values)) == expected
+
+
+def delta_requests(sheet, published, table, title):
+    '''
+    Returns the row deletions/additions on the grid and the blocks of changed and added rows (header is row 0).
+    table is reordered to the row order of the sheet once the delta is applied.
+    '''
+    delta = sheetDelta.diff_tables(published, table)
+    # the snapshot follows the order of rows in the sheet, not in the frame
+    rows = table['rows']
+    table['keys'] = delta['keys']
+    table['rows'] = OrderedDict((key, rows[key]) for key in delta['keys'])
+    if not (delta['changed'] or delta['added'] or delta['removed']):
+        print('{}: unchanged, upload skipped'.format(title))
+        return [], []
+    print('{}: {} rows changed, {} added, {} removed'.format(title, len(delta['changed']), len(delta['added']), len(delta['removed'])))
+
+    # rows are appended before deleting so the sheet never runs out of unfrozen rows,
+    # deletions run bottom up so earlier row indexes stay valid
+    requests = []
+    if delta['added']:
+        requests.append({"appendDimension": {"sheetId": sheet['sheetId'], "dimension": "ROWS", "length": len(delta['added'])}})
+    requests += [{"deleteDimension": {"range": {"sheetId": sheet['sheetId'], "dimension": "ROWS",
+                                                "startIndex": start + 1, "endIndex": stop + 1}}}
+                 for start, stop in reversed(sheetDelta.runs(delta['removed']))]
+
+    blocks = [(sheet['title'], start + 1, [table['rows'][key] for key in delta['keys'][start:stop]])
+              for start, stop in sheetDelta.runs(sorted(delta['changed'] + delta['added']))]
+    return requests, blocks
+
 
-def post_sheet_formatting(credentials, spreadsheet_id, sheetId):
+def sheet_formatting_requests(sheetId):
+    '''
+    formatting of a newly written tab, applied after its values
+    '''
     requests = []
 
     # Make header row stand out
@@ -179,10 +354,4 @@ def post_sheet_formatting(credentials, spreadsheet_id, sheetId):
         }
     })
 
-    body = {
-        'requests': requests
-    }
-    service = discovery.build('sheets', 'v4', credentials=credentials)
-    service.spreadsheets().batchUpdate(
-        spreadsheetId=spreadsheet_id,
-        body=body).execute()
\ No newline at end of file
+    return requests
@@ -0,0 +1,103 @@
+'''
+shared http session for web sources and species lists
+
+One pooled requests session with bounded retries is used for every url in a run and urls are fetched concurrently.
+Responses can be cached on disk and revalidated with ETag/If-Modified-Since so an unchanged
+GitHub tree or experiments json costs a single 304.
+'''
+__author__ = "agent"
+__license__ = "Apache 2.0"
+__date__ = "17/10/2026"
+
+import hashlib
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from app.lib import atomicFile
+
+
+class rate_limit_retry(Retry):
+    # GitHub also rate limits with 403 and Retry-After, a 403 without it is a real permission error and not retried
+    RETRY_AFTER_STATUS_CODES = Retry.RETRY_AFTER_STATUS_CODES | frozenset([403])
+
+
+class http_fetcher:
+
+    def __init__(self, cache_dir=None, retries=3, backoff_factor=2, pool_size=10, timeout=300):
+        self.cache_dir = cache_dir
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.requests_sent = 0
+        self.not_modified = 0
+
+        # bounded retries on connection errors, 5xx and rate limits (429, or 403 with Retry-After), waiting for
+        # Retry-After when the server sends one. Final failure is left to raise_for_status
+        retry = rate_limit_retry(total=retries, backoff_factor=backoff_factor, status_forcelist=(429, 500, 502, 503, 504),
+                                 respect_retry_after_header=True, raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        if cache_dir and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+    def cache_file(self, url):
+        return os.path.join(self.cache_dir, hashlib.sha1(url.encode('utf-8')).hexdigest() + '.json')
+
+    def read_cache(self, url):
+        if not self.cache_dir or not os.path.exists(self.cache_file(url)):
+            return None
+        with open(self.cache_file(url)) as f:
+            return json.load(f)
+
+    def write_cache(self, url, resp):
+        if not self.cache_dir:
+            return
+        cached = dict(url=url, etag=resp.headers.get('ETag'), last_modified=resp.headers.get('Last-Modified'),
+                      body=resp.text)
+        atomicFile.write_json(self.cache_file(url), cached)
+
+    def get_text(self, url):
+        '''
+        Returns the response body, revalidating a cached copy when there is one.
+        Raises requests.exceptions.HTTPError if the server responds with an error.
+        '''
+        cached = self.read_cache(url)
+        headers = {}
+        if cached and cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
+        if cached and cached.get('last_modified'):
+            headers['If-Modified-Since'] = cached['last_modified']
+
+        resp = self.session.get(url, headers=headers, timeout=self.timeout)
+        self.requests_sent += 1
+        if resp.status_code == 304 and cached:
+            self.not_modified += 1
+            logging.info('{} not modified, using cached copy'.format(url))
+            return cached['body']
+
+        # check the status_code of the query, in case a server is down, eg: HTTPError: 500
+        resp.raise_for_status()
+        self.write_cache(url, resp)
+        return resp.text
+
+    def get_json(self, url):
+        return json.loads(self.get_text(url))
+
+    def get_json_many(self, urls):
+        '''
+        Fetches urls concurrently over the shared pool. Results are returned in the order of urls.
+        '''
+        urls = list(urls)
+        if len(urls) <= 1:
+            return [self.get_json(url) for url in urls]
+        with ThreadPoolExecutor(max_workers=min(self.pool_size, len(urls))) as executor:
+            return list(executor.map(self.get_json, urls))
+
+    def close(self):
+        self.session.close()
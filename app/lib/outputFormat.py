@@ -0,0 +1,48 @@
+'''
+formatting of tracker output dataframes before they are written out
+
+List values (e.g. several secondary accessions or curators in one idf) are joined column-wise instead of cell by cell.
+Missing values are normalised separately for outputs like google sheets that need plain strings.
+'''
+__author__ = "agent"
+__license__ = "Apache 2.0"
+__date__ = "17/10/2026"
+
+import pandas as pd
+
+# columns whose cells can hold lists, idf rows are extracted whole and tech comes from the sources config
+LIST_COLUMNS = ['Tech Type', 'Investigation Title', 'Experiment Type', 'Analysis Type', 'Secondary Accessions', 'Curator']
+LIST_SEPARATOR = ' & '
+
+
+def join_list_cells(df, columns=LIST_COLUMNS, sep=LIST_SEPARATOR):
+    '''
+    Returns a copy of df with list cells in the given columns joined into strings. Other cells are unchanged.
+    '''
+    df = df.copy()
+    for colname in [x for x in columns if x in df.columns]:
+        col = df[colname]
+        is_list = col.map(type).eq(list)
+        if is_list.any():
+            df[colname] = col.where(~is_list, col[is_list].str.join(sep))
+    return df
+
+
+def normalise_missing(df, na_rep=''):
+    '''
+    Returns a copy of df with None/NaN replaced by na_rep, as expected in a google sheets payload.
+    '''
+    return df.astype(object).where(pd.notnull(df), na_rep)
+
+
+def columnar_types(df):
+    '''
+    Returns a copy of df that typed columnar formats (parquet, sqlite) accept. Object columns mixing types,
+    e.g. eligibility scores and 'PASS', are written as strings. Missing values are kept.
+    '''
+    df = df.copy()
+    for colname in df.columns:
+        col = df[colname]
+        if col.dtype == object and pd.api.types.infer_dtype(col, skipna=True) not in ('string', 'empty'):
+            df[colname] = col.where(col.isnull(), col.astype(str))
+    return df
@@ -0,0 +1,138 @@
+'''
+destinations the compiled tracker frames are written to
+
+tracker_build writes output_dfs (frame name -> dataframe) through every selected sink.
+google keeps the shared spreadsheet, parquet/csv/sqlite write local copies that can be read without the sheets api.
+Local files are written to a temporary name and moved into place, readers never see a partial file.
+'''
+__author__ = "agent"
+__license__ = "Apache 2.0"
+__date__ = "17/10/2026"
+
+import importlib.util
+import os
+import re
+import sqlite3
+from app.lib import outputFormat
+from app.lib import atomicFile
+
+SINK_NAMES = ['google', 'parquet', 'csv', 'sqlite']
+
+
+def frame_slug(name):
+    '''
+    file/table name of an output frame, e.g. 'Discover Experiments' -> 'discover_experiments'
+    '''
+    return re.sub(r'[^a-z0-9]+', '_', name.lower()).strip('_')
+
+
+class output_sink:
+    name = None
+
+    def write(self, output_dfs):
+        raise NotImplementedError
+
+
+class google_sink(output_sink):
+    name = 'google'
+
+    def __init__(self, google_client_secret, spreadsheetname, mode='full', snapshot_dir=None, progress_path=None,
+                 endpoint=None, spreadsheet_id=None):
+        # a local fake of the sheets api (endpoint) needs no secret
+        if not google_client_secret and not endpoint:
+            raise ValueError('The google sink needs a google client secret.')
+        self.google_client_secret = google_client_secret
+        self.spreadsheetname = spreadsheetname
+        self.mode = mode
+        self.snapshot_dir = snapshot_dir
+        self.progress_path = progress_path
+        self.endpoint = endpoint
+        self.spreadsheet_id = spreadsheet_id
+
+    def write(self, output_dfs):
+        # imported here so local sinks run without the google client libraries
+        from app.lib.googleAPI import google_sheet_output
+        google_sheet_output(self.google_client_secret, output_dfs, self.spreadsheetname, mode=self.mode,
+                            snapshot_dir=self.snapshot_dir, progress_path=self.progress_path,
+                            endpoint=self.endpoint, spreadsheet_id=self.spreadsheet_id)
+
+
+class parquet_sink(output_sink):
+    '''
+    One <frame>.parquet per frame, index (Accession) kept. Needs pyarrow.
+    '''
+    name = 'parquet'
+
+    def __init__(self, output_dir):
+        # optional dependency, checked here so a missing pyarrow fails before the crawl rather than at output
+        if importlib.util.find_spec('pyarrow') is None:
+            raise ImportError('The parquet sink needs pyarrow installed.')
+        self.output_dir = output_dir
+
+    def write(self, output_dfs):
+        for name, df in output_dfs.items():
+            with atomicFile.atomic_path(os.path.join(self.output_dir, frame_slug(name) + '.parquet')) as tmp_path:
+                outputFormat.columnar_types(df).to_parquet(tmp_path, engine='pyarrow')
+        print('Tracker written to parquet in {}'.format(self.output_dir))
+
+
+class csv_sink(output_sink):
+    '''
+    One <frame>.csv per frame, index (Accession) as the first column.
+    '''
+    name = 'csv'
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+
+    def write(self, output_dfs):
+        for name, df in output_dfs.items():
+            with atomicFile.atomic_path(os.path.join(self.output_dir, frame_slug(name) + '.csv')) as tmp_path:
+                df.to_csv(tmp_path)
+        print('Tracker written to csv in {}'.format(self.output_dir))
+
+
+class sqlite_sink(output_sink):
+    '''
+    tracker.sqlite with one table per frame, indexed on the frame index (Accession).
+    '''
+    name = 'sqlite'
+
+    def __init__(self, output_dir, filename='tracker.sqlite'):
+        self.output_dir = output_dir
+        self.path = os.path.join(output_dir, filename)
+
+    def write(self, output_dfs):
+        with atomicFile.atomic_path(self.path) as tmp_path:
+            db = sqlite3.connect(tmp_path)
+            try:
+                for name, df in output_dfs.items():
+                    # to_sql also creates an index on the index column, lookups by accession don't scan the table
+                    outputFormat.columnar_types(df).to_sql(frame_slug(name), db, index=True,
+                                                           index_label=df.index.name or 'index')
+                db.commit()
+            finally:
+                db.close()
+        print('Tracker written to {}'.format(self.path))
+
+
+def build_sinks(names, output_dir=None, google_client_secret=None, spreadsheetname=None, sheet_mode='full',
+                sheet_snapshots=None, sheet_progress=None, sheet_endpoint=None, spreadsheet_id=None):
+    '''
+    returns sinks by name, see SINK_NAMES
+    '''
+    sinks = []
+    for name in names:
+        if name == 'google':
+            sinks.append(google_sink(google_client_secret, spreadsheetname, mode=sheet_mode,
+                                     snapshot_dir=sheet_snapshots, progress_path=sheet_progress,
+                                     endpoint=sheet_endpoint, spreadsheet_id=spreadsheet_id))
+        elif name == 'parquet':
+            sinks.append(parquet_sink(output_dir))
+        elif name == 'csv':
+            sinks.append(csv_sink(output_dir))
+        elif name == 'sqlite':
+            sinks.append(sqlite_sink(output_dir))
+        else:
+            raise ValueError('Output sink {} not known. Choose from {}.'.format(name, SINK_NAMES))
+    return sinks
@@ -0,0 +1,91 @@
+'''
+persistent cache of metadata extracted from idf/sdrf/analysis-methods files
+
+Entries are keyed by file path and are only reused while the (mtime, size, inode) signature of the file is unchanged.
+This lets scheduled runs re-parse only new or modified files instead of re-reading everything on nfs.
+'''
+__author__ = "agent"
+__license__ = "Apache 2.0"
+__date__ = "17/10/2026"
+
+import json
+import math
+import os
+import numpy as np
+from app.lib import atomicFile
+
+# bump when the parsers in fileCrawler change what they extract so stale entries are discarded
+CACHE_VERSION = 2  # 2: unicode_error only covers the lines parse_idf/parse_sdrf read
+
+
+class parse_cache:
+
+    def __init__(self, cache_path, rebuild=False):
+        self.cache_path = cache_path
+        self.rebuild = rebuild
+        self.entries = {}
+        self.seen = set()
+        self.hits = 0
+        self.misses = 0
+
+        if not rebuild and os.path.exists(cache_path):
+            with open(cache_path) as f:
+                cached = json.load(f)
+            if cached.get('version') == CACHE_VERSION:
+                self.entries = cached.get('entries', {})
+            else:
+                print('Parse cache {} has version {}, expected {}. Rebuilding.'.format(cache_path, cached.get('version'), CACHE_VERSION))
+
+    @staticmethod
+    def signature(filename, stat=None):
+        '''
+        Pass a stat result if one is already available from the crawl to avoid another round trip to nfs.
+        '''
+        if stat is None:
+            stat = os.stat(filename)
+        return [stat.st_mtime, stat.st_size, stat.st_ino]
+
+    def get(self, kind, filename, signature):
+        '''
+        Returns the cached record for an unchanged file or None if it has to be parsed again.
+        '''
+        self.seen.add((kind, filename))
+        entry = self.entries.get(kind, {}).get(filename)
+        if entry and entry.get('signature') == signature:
+            self.hits += 1
+            return self.decode(entry.get('record'))
+        self.misses += 1
+        return None
+
+    def put(self, kind, filename, signature, record):
+        self.seen.add((kind, filename))
+        self.entries.setdefault(kind, {})[filename] = {'signature': signature, 'record': self.encode(record)}
+
+    def evict_missing(self):
+        '''
+        Drops entries for files that were not looked up in this run and no longer exist on disk.
+        '''
+        evicted = 0
+        for kind, entries in self.entries.items():
+            for filename in [x for x in entries if (kind, x) not in self.seen]:
+                if not os.path.exists(filename):
+                    del entries[filename]
+                    evicted += 1
+        return evicted
+
+    def save(self):
+        evicted = self.evict_missing()
+        # write then rename so an interrupted run never leaves a truncated cache behind
+        atomicFile.write_json(self.cache_path, {'version': CACHE_VERSION, 'entries': self.entries})
+        print('Parse cache: {} files reused, {} parsed, {} evicted'.format(self.hits, self.misses, evicted))
+
+    @staticmethod
+    def encode(record):
+        # NaN is stored as null. Downstream checks rely on the np.nan object itself (e.g. "is np.nan").
+        fields = {k: (None if isinstance(v, float) and math.isnan(v) else v) for k, v in record['fields'].items()}
+        return dict(record, fields=fields)
+
+    @staticmethod
+    def decode(record):
+        fields = {k: (np.nan if v is None else v) for k, v in record['fields'].items()}
+        return dict(record, fields=fields)
@@ -0,0 +1,214 @@
+'''
+versioned snapshots of tracker runs
+
+Each run saves its compiled output frames and a few accession keyed indexes as Arrow (feather) files in
+<root>/<timestamp>/ with a manifest.json describing the schema. Files are written uncompressed so readers can
+memory-map them and load only the columns they ask for.
+Older snapshots are thinned to one per day and compressed, snapshots past the maximum age are deleted.
+'''
+__author__ = "agent"
+__license__ = "Apache 2.0"
+__date__ = "17/10/2026"
+
+import json
+import os
+import shutil
+from collections import OrderedDict
+from datetime import datetime
+import pandas as pd
+import pyarrow
+from pyarrow import feather
+from app.lib import accessionLookup
+from app.lib import atomicFile
+from app.lib import outputFormat
+from app.lib.outputSinks import frame_slug
+
+SCHEMA_VERSION = 1
+MANIFEST = 'manifest.json'
+KEEP_RECENT = 14  # snapshots kept as written
+MAX_AGE_DAYS = 90
+
+
+def write_snapshot(root, timestamp, output_dfs, indexes, run_info=None):
+    '''
+    Saves output frames and indexes (name -> accession indexed dataframe) to <root>/<timestamp>/.
+    The directory only appears once complete. Returns its path.
+    '''
+    snapshot_dir = os.path.join(root, timestamp)
+    tmp_dir = os.path.join(root, '.{}.tmp'.format(timestamp))
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+
+    manifest = dict(schema_version=SCHEMA_VERSION, timestamp=timestamp, compression='uncompressed',
+                    frames={}, indexes={}, run=run_info or {})
+    for section, prefix, frames in (('frames', '', output_dfs), ('indexes', 'index_', indexes)):
+        for name, df in frames.items():
+            filename = prefix + frame_slug(name) + '.feather'
+            index_name = df.index.name or 'index'
+            table = pyarrow.Table.from_pandas(outputFormat.columnar_types(df).rename_axis(index_name).reset_index(),
+                                              preserve_index=False)
+            feather.write_feather(table, os.path.join(tmp_dir, filename), compression='uncompressed')
+            manifest[section][name] = dict(file=filename, index=index_name, columns=list(df.columns), rows=len(df))
+
+    with open(os.path.join(tmp_dir, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=1)
+    if os.path.exists(snapshot_dir):
+        shutil.rmtree(snapshot_dir)
+    os.rename(tmp_dir, snapshot_dir)
+    return snapshot_dir
+
+
+def read_manifest(snapshot_dir):
+    with open(os.path.join(snapshot_dir, MANIFEST)) as f:
+        manifest = json.load(f)
+    if manifest.get('schema_version', 0) > SCHEMA_VERSION:
+        raise ValueError('Snapshot {} has schema version {}, this code reads up to {}'.format(
+            snapshot_dir, manifest.get('schema_version'), SCHEMA_VERSION))
+    return manifest
+
+
+def list_snapshots(root):
+    '''
+    returns complete snapshot directories in root, newest first
+    '''
+    if not os.path.isdir(root):
+        return []
+    snapshots = [os.path.join(root, x) for x in os.listdir(root)
+                 if not x.startswith('.') and os.path.exists(os.path.join(root, x, MANIFEST))]
+    return sorted(snapshots, key=lambda x: read_manifest(x)['timestamp'], reverse=True)
+
+
+def latest_snapshot(root):
+    snapshots = list_snapshots(root)
+    if not snapshots:
+        raise FileNotFoundError('No tracker snapshots in {}'.format(root))
+    return snapshots[0]
+
+
+def load(snapshot_dir, name, columns=None, section='frames'):
+    '''
+    Reads one frame (section='frames') or index (section='indexes') of a snapshot, indexed by accession.
+    Only the given columns are read from the memory-mapped file.
+    '''
+    entry = read_manifest(snapshot_dir)[section][name]
+    if columns is not None:
+        columns = [entry['index']] + [x for x in columns if x != entry['index']]
+    table = feather.read_table(os.path.join(snapshot_dir, entry['file']), columns=columns, memory_map=True)
+    return table.to_pandas().set_index(entry['index'])
+
+
+def load_frames(snapshot_dir):
+    '''
+    returns every output frame of a snapshot in the order they were written
+    '''
+    return OrderedDict((name, load(snapshot_dir, name)) for name in read_manifest(snapshot_dir)['frames'])
+
+
+def compact(snapshot_dir, compression='zstd'):
+    '''
+    Rewrites the files of a snapshot compressed. Compressed snapshots are still readable but not memory-mapped.
+    '''
+    manifest = read_manifest(snapshot_dir)
+    if manifest['compression'] == compression:
+        return
+    for section in ('frames', 'indexes'):
+        for entry in manifest[section].values():
+            path = os.path.join(snapshot_dir, entry['file'])
+            table = feather.read_table(path)
+            with atomicFile.atomic_path(path) as tmp_path:
+                feather.write_feather(table, tmp_path, compression=compression)
+    manifest['compression'] = compression
+    atomicFile.write_json(os.path.join(snapshot_dir, MANIFEST), manifest, indent=1)
+
+
+def retain(root, keep_recent=KEEP_RECENT, max_age_days=MAX_AGE_DAYS, now=None):
+    '''
+    Rolling retention. The keep_recent newest snapshots are kept as written, older ones are thinned to the last
+    snapshot of each day and compressed, anything older than max_age_days is deleted.
+    '''
+    now = now or datetime.now()
+    kept_days = set()
+    removed = compacted = 0
+    for i, snapshot_dir in enumerate(list_snapshots(root)):
+        timestamp = datetime.fromisoformat(read_manifest(snapshot_dir)['timestamp'])
+        if (now - timestamp).days >= max_age_days:
+            shutil.rmtree(snapshot_dir)
+            removed += 1
+        elif i >= keep_recent:
+            if timestamp.date() in kept_days:
+                shutil.rmtree(snapshot_dir)
+                removed += 1
+            else:
+                kept_days.add(timestamp.date())
+                if read_manifest(snapshot_dir)['compression'] == 'uncompressed':
+                    compact(snapshot_dir)
+                    compacted += 1
+    if removed or compacted:
+        print('Snapshots: {} removed, {} compacted'.format(removed, compacted))
+
+
+class saved_status:
+    '''
+    Accession lookups from a snapshot for dev tools. Each attribute reads only the index columns it needs
+    the first time it is used.
+    '''
+
+    def __init__(self, snapshot_dir):
+        self.snapshot_dir = snapshot_dir
+        self.cache = {}
+
+    def column(self, index, column):
+        return load(self.snapshot_dir, index, [column], section='indexes')[column]
+
+    def cached(self, name, build):
+        if name not in self.cache:
+            self.cache[name] = build()
+        return self.cache[name]
+
+    @property
+    def all_primary_accessions(self):
+        return self.cached('all_primary_accessions', lambda: set(self.column('accessions', 'Status').index))
+
+    @property
+    def internal_accessions(self):
+        # min status is external when the stages of the status include it, external is first in status_type_order
+        return self.cached('internal_accessions', lambda: set(
+            x for x, status in self.column('accessions', 'Status').items() if 'external' not in str(status).split(' ')))
+
+    @property
+    def idf_path_by_accession(self):
+        return self.cached('idf_path_by_accession', lambda: self.column('accessions', 'IDF').dropna().to_dict())
+
+    @property
+    def sdrf_path_by_accession(self):
+        return self.cached('sdrf_path_by_accession', lambda: self.column('accessions', 'SDRF').dropna().to_dict())
+
+    @property
+    def all_secondary_accessions(self):
+        return self.cached('all_secondary_accessions',
+                           lambda: set(self.column('secondary_accessions', 'Secondary Accession')))
+
+    @property
+    def secondary_accessions_mapping(self):
+        return self.cached('secondary_accessions_mapping',
+                           lambda: self.column('secondary_accessions', 'Secondary Accession')
+                           .groupby(level=0, sort=False).agg(list).to_dict())
+
+
+def accession_indexes(status_crawl, extracted_metadata):
+    '''
+    Accession keyed indexes saved with each run: status and metadata file paths of every primary accession,
+    and one row per (accession, secondary accession) pair.
+    '''
+    accessions = pd.Index(sorted(status_crawl.all_primary_accessions), name='Accession')
+    columns = [('Status', status_crawl.accession_final_status),
+               ('Discovery Location', status_crawl.path_by_accession),
+               ('IDF', status_crawl.idf_path_by_accession),
+               ('SDRF', status_crawl.sdrf_path_by_accession)]
+    accession_df = pd.DataFrame({name: [str(values[x]) if values.get(x) is not None else None for x in accessions]
+                                 for name, values in columns}, index=accessions)
+
+    pairs = accessionLookup.secondary_pairs(extracted_metadata.get('Secondary Accession'))
+    secondary_df = pd.DataFrame(pairs, columns=['Accession', 'Secondary Accession']).set_index('Accession')
+    return {'accessions': accession_df, 'secondary_accessions': secondary_df}
@@ -0,0 +1,111 @@
+'''
+row level comparison of an output frame with the copy last published to google sheets
+
+The published copy is kept locally as json (header, row keys in sheet order and cell values) so a run can work out
+which rows changed, were added or were removed without reading the sheet back.
+No google api calls are made here, see googleAPI.google_sheet_output.
+'''
+__author__ = "agent"
+__license__ = "Apache 2.0"
+__date__ = "17/10/2026"
+
+import json
+import os
+import re
+from collections import OrderedDict
+from numbers import Real
+from app.lib import atomicFile
+
+
+def cell_value(value):
+    '''
+    Value as sent to the sheet: numbers and booleans as they are, anything else as a string (as gspread_dataframe did).
+    Expects missing values to be normalised already (outputFormat.normalise_missing).
+    '''
+    if isinstance(value, Real):
+        return value.item() if hasattr(value, 'item') else value
+    return str(value)
+
+
+def frame_values(df):
+    '''
+    Header and rows of a frame as written to the sheet, index as the first column.
+    '''
+    header = [str(df.index.name or '')] + [str(x) for x in df.columns]
+    return [header] + [[cell_value(key)] + [cell_value(x) for x in values]
+                       for key, values in zip(df.index, df.itertuples(index=False, name=None))]
+
+
+def sheet_table(df):
+    '''
+    Returns dict(header, keys, rows) for a frame written with its index as the first column.
+    Rows are keyed by the index (accession) and are only comparable if the index is unique, otherwise returns None.
+    '''
+    if not df.index.is_unique:
+        return None
+    values = frame_values(df)
+    keys = [str(x) for x in df.index]
+    return dict(header=values[0], keys=keys, rows=OrderedDict(zip(keys, values[1:])))
+
+
+def diff_tables(published, table):
+    '''
+    Compares a new sheet_table with the published one.
+    Rows keep their place in the sheet, removed rows are dropped and new rows are appended at the bottom.
+    Returns dict(keys, changed, added, removed). keys is the row order once the delta is applied,
+    changed and added are positions in that order and removed are positions in the published order (0 = first data row).
+    '''
+    new_keys = set(table['keys'])
+    removed = [i for i, key in enumerate(published['keys']) if key not in new_keys]
+    kept = [key for key in published['keys'] if key in new_keys]
+    kept_keys = set(kept)
+    appended = [key for key in table['keys'] if key not in kept_keys]
+    keys = kept + appended
+
+    changed = [i for i, key in enumerate(kept) if published['rows'][key] != table['rows'][key]]
+    added = list(range(len(kept), len(keys)))
+    return dict(keys=keys, changed=changed, added=added, removed=removed)
+
+
+def runs(positions):
+    '''
+    Groups sorted positions into contiguous (start, stop) runs, stop exclusive. Each run is one range in the update.
+    '''
+    grouped = []
+    for pos in positions:
+        if grouped and grouped[-1][1] == pos:
+            grouped[-1][1] = pos + 1
+        else:
+            grouped.append([pos, pos + 1])
+    return [tuple(x) for x in grouped]
+
+
+def column_letter(n):
+    '''
+    A1 column letter for a 1-based column number, e.g. 1 -> A, 27 -> AA
+    '''
+    letters = ''
+    while n > 0:
+        n, rem = divmod(n - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+
+def snapshot_path(snapshot_dir, spreadsheetname, title):
+    safe = lambda x: re.sub(r'[^A-Za-z0-9_.-]+', '_', x)
+    return os.path.join(snapshot_dir, safe(spreadsheetname), safe(title) + '.json')
+
+
+def read_snapshot(path):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f, object_pairs_hook=OrderedDict)
+
+
+def write_snapshot(path, table, sheet_id):
+    '''
+    Saves the published table and the id of the worksheet holding it. Written atomically, a failed run keeps the old copy.
+    '''
+    snapshot = dict(sheet_id=sheet_id, header=table['header'], keys=table['keys'], rows=table['rows'])
+    atomicFile.write_json(path, snapshot)
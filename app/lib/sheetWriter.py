@@ -0,0 +1,221 @@
+'''
+paced and retried writes to the google sheets api
+
+Sheets quotas are per minute (60 write requests per user by default), so calls are paced with a token bucket.
+Values are split into chunks of rows that are written one request each. A chunk that fails with a quota or server
+error is retried on its own with jittered exponential backoff, chunks already written are not sent again.
+Written chunks are recorded in a progress file so an interrupted upload resumes where it stopped.
+
+The writer only needs a client with values_batch_update(spreadsheet_id, data), e.g. googleAPI.sheets_client,
+which can be pointed at a local fake endpoint.
+'''
+__author__ = "agent"
+__license__ = "Apache 2.0"
+__date__ = "17/10/2026"
+
+import hashlib
+import json
+import logging
+import os
+import random
+import threading
+import time
+from app.lib import sheetDelta
+from app.lib import atomicFile
+
+REQUESTS_PER_MINUTE = 60
+CHUNK_CELLS = 50000
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+
+class token_bucket:
+    '''
+    Allows rate tokens per second on average with bursts of up to capacity.
+    '''
+
+    def __init__(self, rate, capacity, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.clock = clock
+        self.sleep = sleep
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            while True:
+                now = self.clock()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                self.sleep((1 - self.tokens) / self.rate)
+
+
+def error_status(error):
+    '''
+    http status of a failed call, None for errors without a response (socket timeout, connection reset)
+    '''
+    resp = getattr(error, 'resp', None)
+    status = getattr(resp, 'status', None)
+    return int(status) if status is not None else None
+
+
+def retryable(error, idempotent=True):
+    '''
+    Quota errors (429) are rejected before anything is applied and can always be retried.
+    Server errors and lost connections may have been applied, they are only retried for idempotent calls.
+    '''
+    status = error_status(error)
+    if status == 429:
+        return True
+    if not idempotent:
+        return False
+    if status is None:
+        return isinstance(error, OSError)  # socket timeouts and connection errors
+    return status in RETRY_STATUS
+
+
+def a1_range(sheet_title, first_row, n_rows, n_columns):
+    '''
+    A1 range of n_rows x n_columns starting at column A of first_row (0 = header row)
+    '''
+    return "'{}'!A{}:{}{}".format(sheet_title.replace("'", "''"), first_row + 1,
+                                  sheetDelta.column_letter(n_columns), first_row + n_rows)
+
+
+def chunk_blocks(blocks, chunk_cells=CHUNK_CELLS):
+    '''
+    Splits blocks of rows, (sheet title, first row, rows), into chunks of about chunk_cells cells.
+    A chunk is the data of one values.batchUpdate: a list of dict(range, values).
+    Small blocks share a chunk, large blocks are split by rows.
+    '''
+    chunks = []
+    chunk, cells = [], 0
+    for sheet_title, first_row, rows in blocks:
+        if not rows:
+            continue
+        n_columns = max(len(x) for x in rows)
+        step = max(1, chunk_cells // n_columns)
+        for start in range(0, len(rows), step):
+            piece = rows[start:start + step]
+            if chunk and cells + len(piece) * n_columns > chunk_cells:
+                chunks.append(chunk)
+                chunk, cells = [], 0
+            chunk.append({"range": a1_range(sheet_title, first_row + start, len(piece), n_columns), "values": piece})
+            cells += len(piece) * n_columns
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def chunk_digest(chunk):
+    return hashlib.sha1(json.dumps(chunk, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class upload_progress:
+    '''
+    State of an upload to one spreadsheet: tabs created for it (title -> sheet properties) and digests of the
+    chunks already written. Kept in memory only when path is None.
+    Progress recorded for another spreadsheet is ignored.
+    '''
+
+    def __init__(self, path, spreadsheet_id):
+        self.path = path
+        self.spreadsheet_id = spreadsheet_id
+        self.tabs = {}
+        self.done = set()
+        if path and os.path.exists(path):
+            with open(path) as f:
+                saved = json.load(f)
+            if saved.get('spreadsheet_id') == spreadsheet_id:
+                self.tabs = saved.get('tabs', {})
+                self.done = set(saved.get('done', []))
+                print('Resuming sheet upload, {} chunks already written'.format(len(self.done)))
+
+    def save(self):
+        if not self.path:
+            return
+        atomicFile.write_json(self.path, dict(spreadsheet_id=self.spreadsheet_id, tabs=self.tabs, done=sorted(self.done)))
+
+    def clear(self):
+        self.tabs = {}
+        self.done = set()
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class chunked_writer:
+
+    def __init__(self, client, spreadsheet_id, requests_per_minute=REQUESTS_PER_MINUTE, chunk_cells=CHUNK_CELLS,
+                 max_attempts=6, base_delay=2, max_delay=120, clock=time.monotonic, sleep=time.sleep):
+        self.client = client
+        self.spreadsheet_id = spreadsheet_id
+        self.chunk_cells = chunk_cells
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.sleep = sleep
+        self.bucket = token_bucket(requests_per_minute / 60.0, max(1, requests_per_minute // 6), clock=clock, sleep=sleep)
+        self.retries = 0
+
+    def backoff(self, attempt):
+        # full jitter, spreads out retries of concurrent writers
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        print('Hit Google API error. Waiting {:.0f} sec then retrying...'.format(delay))
+        self.sleep(delay)
+
+    def call(self, fn, *args, idempotent=True):
+        '''
+        Paced call with retries, for requests that are not chunked (metadata reads, structural batchUpdates).
+        '''
+        for attempt in range(self.max_attempts):
+            self.bucket.acquire()
+            try:
+                return fn(*args)
+            except Exception as e:
+                if attempt == self.max_attempts - 1 or not retryable(e, idempotent):
+                    raise
+                logging.warning('Google API call failed (status {}): {}'.format(error_status(e), e))
+                self.retries += 1
+                self.backoff(attempt)
+
+    def write_values(self, blocks, progress):
+        '''
+        Writes blocks of rows, (sheet title, first row, rows), chunk by chunk. Chunks recorded in progress are skipped.
+        Failed chunks are retried after the others were sent. Raises the last error when chunks are still
+        failing after max_attempts rounds, the progress file then lets the next run resume.
+        '''
+        chunks = chunk_blocks(blocks, self.chunk_cells)
+        pending = [(chunk_digest(x), x) for x in chunks]
+        pending = [(digest, x) for digest, x in pending if digest not in progress.done]
+        if len(pending) < len(chunks):
+            print('{} of {} value chunks already written'.format(len(chunks) - len(pending), len(chunks)))
+
+        for attempt in range(self.max_attempts):
+            failed = []
+            last_error = None
+            for digest, chunk in pending:
+                self.bucket.acquire()
+                try:
+                    self.client.values_batch_update(self.spreadsheet_id, chunk)
+                except Exception as e:
+                    if not retryable(e):
+                        raise
+                    logging.warning('Chunk {} failed (status {}): {}'.format(chunk[0]['range'], error_status(e), e))
+                    failed.append((digest, chunk))
+                    last_error = e
+                    continue
+                progress.done.add(digest)
+                progress.save()
+
+            if not failed:
+                return len(chunks)
+            if attempt == self.max_attempts - 1:
+                print('{} of {} value chunks could not be written'.format(len(failed), len(chunks)))
+                raise last_error
+            self.retries += len(failed)
+            pending = failed
+            self.backoff(attempt)
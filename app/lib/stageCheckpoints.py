@@ -0,0 +1,72 @@
+'''
+in memory checkpoints of tracker_build stages
+
+Each stage result is kept once the stage completes. When tracker_build retries after a failure, completed
+stages return their checkpoint and the run resumes from the first stage that failed.
+Attempts and timings are kept per stage and reported at the end of the run, with any notes stages left.
+'''
+__author__ = "agent"
+__license__ = "Apache 2.0"
+__date__ = "17/10/2026"
+
+import logging
+import time
+from collections import OrderedDict
+
+
+class stage_checkpoints:
+
+    def __init__(self):
+        self.results = OrderedDict()  # stage -> result of its completed run
+        self.attempts = OrderedDict()  # stage -> [(seconds, 'ok'|'failed')]
+        self.notes = OrderedDict()  # stage -> [message], printed with the report
+
+    def run(self, stage, fn, *args, **kwargs):
+        '''
+        Returns the checkpoint of stage if it completed before, otherwise runs fn and checkpoints its result.
+        '''
+        if stage in self.results:
+            logging.info('{}: resumed from checkpoint'.format(stage))
+            return self.results[stage]
+
+        attempts = self.attempts.setdefault(stage, [])
+        start = time.monotonic()
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException:
+            attempts.append((time.monotonic() - start, 'failed'))
+            logging.warning('{}: attempt {} failed after {:.1f}s'.format(stage, len(attempts), attempts[-1][0]))
+            raise
+        attempts.append((time.monotonic() - start, 'ok'))
+        logging.info('{}: completed in {:.1f}s (attempt {})'.format(stage, attempts[-1][0], len(attempts)))
+        self.results[stage] = result
+        return result
+
+    def note(self, stage, message):
+        # a retry resuming from checkpoints can note the same thing again, it is reported once
+        notes = self.notes.setdefault(stage, [])
+        if message not in notes:
+            notes.append(message)
+            logging.warning('{}: {}'.format(stage, message))
+
+    def failed_stage(self):
+        '''
+        first stage whose last attempt failed, None if every stage run so far completed
+        '''
+        for stage, attempts in self.attempts.items():
+            if attempts[-1][1] == 'failed':
+                return stage
+        return None
+
+    def report(self):
+        print('Stage timings:')
+        for stage, attempts in self.attempts.items():
+            print('  {:<24} {} attempt(s) {:>8.1f}s total, last {}'.format(
+                stage, len(attempts), sum(x[0] for x in attempts), attempts[-1][1]))
+            for message in self.notes.get(stage, []):
+                print('    note: {}'.format(message))
+        for stage, notes in self.notes.items():
+            if stage not in self.attempts:  # skipped stages
+                print('  {:<24} not run'.format(stage))
+                for message in notes:
+                    print('    note: {}'.format(message))
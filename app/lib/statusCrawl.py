@@ -10,20 +10,175 @@ __date__ = "15/07/2019"
 
 import json
 from datetime import datetime
-import os
 import re
-from collections import defaultdict
-from tqdm import tqdm
-import glob
-import requests
+from collections import OrderedDict
+from collections.abc import ItemsView, Mapping, ValuesView
+from functools import partial
+import logging
+from app.lib import fsWalk
+from app.lib import httpFetch
+
+
+def file_accession(filepath):
+    # accession of an idf/sdrf/analysis-methods file from its name
+    return filepath.split('/')[-1].replace('.idf.txt', '').replace('.sdrf.txt', '').replace('-idf.txt', '').replace('-sdrf.txt', '').replace('-analysis-methods.tsv', '')
+
+
+class index_view(Mapping):
+    '''
+    Read only accession -> value mapping over the accession index. keys maps accession -> integer code and
+    values holds the value of each code, so lookups are two O(1) indexings and nothing is copied per accession.
+    '''
+
+    def __init__(self, keys, values):
+        self.keys_ = keys
+        self.values_ = values
+
+    def __getitem__(self, accession):
+        return self.values_[self.keys_[accession]]
+
+    def __iter__(self):
+        return iter(self.keys_)
+
+    def __len__(self):
+        return len(self.keys_)
+
+    def __contains__(self, accession):
+        return accession in self.keys_
+
+    def items(self):
+        return index_items(self)
+
+    def values(self):
+        return index_values(self)
+
+
+class index_items(ItemsView):
+    # reusable items view like dict.items(), iterated without a lookup per accession
+    def __iter__(self):
+        values = self._mapping.values_
+        return ((k, values[v]) for k, v in self._mapping.keys_.items())
+
+
+class index_values(ValuesView):
+    def __iter__(self):
+        values = self._mapping.values_
+        return (values[v] for v in self._mapping.keys_.values())
+
+
+class found_view(Mapping):
+    '''
+    (path, accession) -> dict(accession, tech, stage, resource, source) view of the accessions found in each source
+    '''
+
+    def __init__(self, index):
+        self.index = index
+
+    def __getitem__(self, key):
+        path, accession = key
+        if self.index.source_id[path] not in self.index.found[accession]:
+            raise KeyError(key)
+        info = self.index.sources_config[path]
+        return dict(accession=accession, tech=info.get('tech', None), stage=info.get('stage', None),
+                    resource=info.get('resource', None), source=info.get('source', None))
+
+    def __iter__(self):
+        return ((path, accession) for path, accessions in zip(self.index.sources, self.index.source_accessions)
+                for accession in accessions)
+
+    def __len__(self):
+        return sum(len(accessions) for accessions in self.index.source_accessions)
+
+
+class accession_index:
+    '''
+    Accessions found in the crawled sources, built once per crawl.
+    Stages are coded as their position in status_type_order and each source gets its stage codes and rank
+    (position when sources are ordered by their latter most stage) up front, so per accession work is integer
+    comparisons. Per accession only source ids are kept: the source deciding the status (latter most last stage),
+    the discovery location (latter ranked source) and every source it was found in, plus the latter ranked
+    idf/sdrf/analysis file paths.
+    '''
 
-class atlas_status:
     def __init__(self, sources_config, status_type_order):
+        self.sources_config = sources_config
+        self.status_type_order = list(status_type_order)
+        self.stage_code = {stage: code for code, stage in enumerate(self.status_type_order)}
+
+        # per source, indexed by source id (position in sources_config)
+        self.sources = list(sources_config)
+        self.source_id = {path: sid for sid, path in enumerate(self.sources)}
+        stage_codes = [[self.stage_code[x] for x in sources_config[path]['stage']] for path in self.sources]
+        self.source_last_code = [codes[-1] for codes in stage_codes]
+        self.source_status = [' '.join(sources_config[path]['stage']) for path in self.sources]
+        self.source_min_status = [self.status_type_order[min(codes)] for codes in stage_codes]
+        self.source_max_status = [self.status_type_order[max(codes)] for codes in stage_codes]
+        self.source_tech = [sorted(sources_config[path].get('tech')) if sources_config[path].get('tech') is not None
+                            else None for path in self.sources]
+        ranked = sorted((max(codes), path) for codes, path in zip(stage_codes, self.sources))
+        self.source_rank = [0] * len(self.sources)
+        for rank, (_, path) in enumerate(ranked):
+            self.source_rank[self.source_id[path]] = rank
+
+        # per accession
+        self.found = {}  # accession -> ids of the sources it was found in, in crawl order
+        self.source_accessions = [[] for _ in self.sources]  # source id -> accessions found there, in crawl order
+        self.status_source = {}  # accession -> source id deciding its status
+        self.location_source = {}  # accession -> source id of its latter ranked discovery location
+        self.files = {'idf': {}, 'sdrf': {}, 'analysis': {}}  # kind -> accession -> latter ranked file path
+        self.file_ranks = {'idf': {}, 'sdrf': {}, 'analysis': {}}
+
+    def add(self, path, accession):
+        sid = self.source_id[path]
+        sids = self.found.get(accession)
+        if sids is None:
+            self.found[accession] = [sid]
+            self.source_accessions[sid].append(accession)
+            self.status_source[accession] = sid
+            self.location_source[accession] = sid
+            return
+        if sid in sids:
+            return
+        sids.append(sid)
+        self.source_accessions[sid].append(accession)
+        if self.source_last_code[sid] > self.source_last_code[self.status_source[accession]]:
+            self.status_source[accession] = sid
+        if self.source_rank[sid] > self.source_rank[self.location_source[accession]]:
+            self.location_source[accession] = sid
+
+    def add_file(self, kind, path, filepath, accession=None):
+        # keeps the file of the latter ranked source, the first one found on ties
+        accession = accession or file_accession(filepath)
+        rank = self.source_rank[self.source_id[path]]
+        ranks = self.file_ranks[kind]
+        if accession not in ranks or rank > ranks[accession]:
+            ranks[accession] = rank
+            self.files[kind][accession] = filepath
+
+    def status(self):
+        return index_view(self.status_source, self.source_status)
+
+    def min_status(self):
+        return index_view(self.status_source, self.source_min_status)
+
+    def max_status(self):
+        return index_view(self.status_source, self.source_max_status)
+
+    def path(self):
+        return index_view(self.location_source, self.sources)
+
+    def tech(self):
+        return index_view(self.location_source, self.source_tech)
+
+
+class atlas_status:
+    def __init__(self, sources_config, status_type_order, source_timeout=None, http=None):
 
         # configuration
         with open(sources_config) as f:
             self.sources_config = json.load(f)
         self.status_type_order = status_type_order
+        self.source_timeout = source_timeout  # seconds, can be overridden per path with "timeout" in sources_config
         self.accession_regex = re.compile('^E-[A-Z]{4}-\d+$')
 
         # status tracking
@@ -34,12 +189,24 @@ class atlas_status:
         self.timestamp = datetime.fromtimestamp(datetime.now().timestamp()).isoformat()
         print('Initialised {}'.format(self.timestamp))
 
-        # accession search
-        # scans dir in config to find '*.idf.txt' or accession directories
+        # all sources crawled concurrently, single scandir pass over each nfs path and one request per url
+        # results are shared by the searches below and the file crawler
+        own_http = http is None
+        http = http or httpFetch.http_fetcher()
         try:
-            accession_search = self.accession_search() # in case server is down occasionally
-        except requests.exceptions.HTTPError:
-            raise
+            crawl_sources = self.crawl_sources(http)  # in case server is down occasionally HTTPError is raised here
+        finally:
+            if own_http:  # a fetcher passed in is closed by its owner
+                http.close()
+        self.manifests = crawl_sources[0]
+        self.web_experiments = crawl_sources[1]
+        self.source_health = crawl_sources[2]
+
+        # accession search
+        # finds '*.idf.txt' or accession directories in crawled sources
+        # every accession lookup below is a view over one accession index built here
+        self.index = accession_index(self.sources_config, self.status_type_order)
+        accession_search = self.accession_search()
         self.all_primary_accessions = accession_search[0]
         self.found_accessions = accession_search[1]
 
@@ -61,13 +228,14 @@ class atlas_status:
         self.tech = self.get_tech()
 
     def get_tech(self):
-        tech_dict = {}
-        for accession, path in self.path_by_accession.items():
-            tech = self.sources_config.get(path).get('tech')
-            tech_dict[accession] = sorted(tech)
-        return tech_dict
+        # sorted tech of the discovery location of each accession
+        return self.index.tech()
 
 
+    def degraded_sources(self):
+        # sources whose accessions are missing from this crawl
+        return [path for path, health in self.source_health.items() if health['status'] == 'degraded']
+
     def get_status_types(self):
         status_types = set()
         for x, y in self.sources_config.items():
@@ -75,150 +243,110 @@ class atlas_status:
                 status_types.add(n)
         return list(status_types)
 
+    @staticmethod
+    def fetch_web_source(http, path):
+        # raises HTTPError in case atlas server is down, eg: HTTPError: 500
+        # data = resp.json().get('aaData')
+        return http.get_json(path).get('experiments')
+
+    def crawl_sources(self, http):
+        '''
+        Each path in the config is crawled in its own thread with its own deadline so one slow or hung mount does
+        not stall the others. A source that misses its deadline is reported as degraded and contributes no
+        accessions, see degraded_sources(). Errors (e.g. HTTPError from a web source) are raised as before.
+        '''
+        print('Crawling {} sources {}'.format(len(self.sources_config),
+                                              datetime.fromtimestamp(datetime.now().timestamp()).isoformat()))
+        tasks = OrderedDict()
+        timeouts = {}
+        for path, info in self.sources_config.items():
+            if path.startswith('https://'):  # web path handling
+                tasks[path] = partial(self.fetch_web_source, http, path)
+            else:  # nfs dir handling
+                tasks[path] = partial(fsWalk.scan_source, path)
+            timeouts[path] = info.get('timeout', self.source_timeout)
+
+        outcomes = fsWalk.run_with_deadlines(tasks, timeouts)
+
+        manifests = OrderedDict()
+        web_experiments = OrderedDict()
+        source_health = OrderedDict()
+        for path, outcome in outcomes.items():
+            source_health[path] = dict(status=outcome['status'], latency=round(outcome['latency'], 3))
+            if outcome['status'] == 'error':
+                raise outcome['error']
+            elif outcome['status'] == 'degraded':
+                logging.warning('Source {} missed its {}s deadline and is degraded for this run'.format(path, timeouts[path]))
+                print('WARNING: source {} DEGRADED after {:.1f}s. Its accessions are missing from this run.'.format(path, outcome['latency']))
+            elif path.startswith('https://'):
+                web_experiments[path] = outcome['result']
+            else:
+                manifests[path] = outcome['result']
+            logging.info('Source {} {} in {:.1f}s'.format(path, outcome['status'], outcome['latency']))
+
+        return manifests, web_experiments, source_health
+
     def accession_search(self):
 
-        def accession_match(accession, info, path, all_primary_accessions, found_accessions):
+        def accession_match(accession, path):
             if self.accession_regex.match(accession):
-                all_primary_accessions.add(accession)
-                found_accessions[(path, accession)] = dict(
-                    # config_path=path,
-                    accession=accession,
-                    tech=info.get('tech', None),
-                    stage=info.get('stage', None),
-                    resource=info.get('resource', None),
-                    source=info.get('source', None)
-                )
-            return all_primary_accessions, found_accessions
+                self.index.add(path, accession)
 
         print('Performing accession search {}'.format(
             datetime.fromtimestamp(datetime.now().timestamp()).isoformat()))
-        all_primary_accessions = set()
-        found_accessions = {}
         counter = 0
 
         for path, info in self.sources_config.items():
             counter += 1
-            if path.startswith('https://'): # web path handling
+            if self.source_health[path]['status'] == 'degraded':
+                print('Skipping degraded path {} {}/{}'.format(path, counter, len(self.sources_config)))
+            elif path.startswith('https://'): # web path handling
                 print('query url {} {}/{}'.format(path, counter, len(self.sources_config)))
-                resp = requests.get(url=path)
-                # check the status_code of the query, in case atlas server is down, eg: HTTPError: 500
-                assert resp.ok, resp.raise_for_status()
-
-                # data = resp.json().get('aaData')
-                data = resp.json().get('experiments')
+                data = self.web_experiments[path]
                 for experiment in data:
                     accession = experiment.get('experimentAccession')
-                    accession_match(accession, info, path, all_primary_accessions, found_accessions)
+                    accession_match(accession, path)
                     # todo pass loadDate or lastUpdate date from web to tracker
             else: # nfs dir handling
                 print('Searching path {} {}/{}'.format(path, counter, len(self.sources_config)))
 
-                pre_accessions = os.listdir(path)
+                pre_accessions = self.manifests[path].entries
                 for pre_accession in pre_accessions:
                     if not pre_accession.endswith('.merged.idf.txt'):
                         accession = pre_accession.strip('.idf.txt')
-                        accession_match(accession, info, path, all_primary_accessions, found_accessions)
+                        accession_match(accession, path)
 
+        found_accessions = found_view(self.index)
         print('Found {} accessions in {} directories'.format(len(found_accessions), len(self.sources_config)))
 
-        return all_primary_accessions, found_accessions
+        return set(self.index.found), found_accessions
 
     def status_tracker(self):
+        # status of each accession is the stage list of the source with the latter most last stage, first found on ties
         print('Calculating status of each project {}'.format(datetime.fromtimestamp(datetime.now().timestamp()).isoformat()))
-        accession_status = {}
-        accession_status_counter = {}
-        for key, value in self.found_accessions.items():
-            accession = value['accession']
-            stage = value['stage']
-
-            index = self.status_type_order.index(stage[-1])
-            if accession not in accession_status_counter:
-                accession_status_counter[accession] = index
-                accession_status[accession] = ' '.join(stage)
-            elif index > accession_status_counter.get(accession):
-                accession_status_counter[accession] = index
-                accession_status[accession] = ' '.join(stage)
-
-        return accession_status
+        return self.index.status()
 
     def get_min_max_status(self):
-        # Some paths define multiple statuses. This narrows it to the latter most status according to status_type_order
-        accession_min_status = {}
-        accession_max_status = {}
-        for accession, status in self.accession_final_status.items():
-            accession_min_status[accession] = self.status_type_order[min([self.status_type_order.index(x) for x in status.split(' ')])]
-            accession_max_status[accession] = self.status_type_order[max([self.status_type_order.index(x) for x in status.split(' ')])]
-
-        return accession_min_status, accession_max_status
+        # Some paths define multiple statuses. This narrows it to the earliest and latter most status according to status_type_order
+        return self.index.min_status(), self.index.max_status()
 
     def get_latest_idf_sdrf(self):
         '''
         Does not return idf/sdrf paths for experiments found on https endpoints.
-        Latest loc will be latest found on nfs.
+        Latest loc will be latest found on nfs, files are ranked by the source whose manifest listed them.
         '''
 
-
         print('Getting latest IDF and SDRF paths {}'.format(
             datetime.fromtimestamp(datetime.now().timestamp()).isoformat()))
 
-        def list_converter(file_list):
-            files_found = {}
-            for filepath in file_list:
-                accession = filepath.split('/')[-1].replace('.idf.txt', '').replace('.sdrf.txt', '').replace('-idf.txt', '').replace('-sdrf.txt', '').replace('-analysis-methods.tsv', '')
-                if accession in files_found:
-                    files_found[accession].append(filepath)
-                else:
-                    files_found[accession] = [filepath]
-            return files_found
-
-        def get_ranked_paths():
-            # ranks path by status type, used to estimate out where latest metadata is.
-            preordered_paths = []
-            latest_stage_ranks = []
-            for path, metadata in self.sources_config.items():
-                preordered_paths.append(path)
-                latest_stage_ranks.append(max([self.status_type_order.index(n) for n in metadata.get('stage')]))
-            return [x for _,x in sorted(zip(latest_stage_ranks,preordered_paths))]
-
-        def get_latter_ranked_path(paths_by_accession, ranked_paths):
-            ranked_paths_by_accession = {}
-            for accession, path_list in paths_by_accession.items():
-                if len(path_list) == 1:
-                    latest_path = path_list[0]
-                else:
-                    try:
-                        trunc_paths = [v.split('/E-')[0] for v in path_list]  # remove accession specific endings
-                        path_ranks = [ranked_paths.index(n) for n in trunc_paths]
-                        latest_path = path_list[path_ranks.index(max(path_ranks))]  # get idf/sdrf from latter loc
-                    except ValueError:
-                        continue
-                ranked_paths_by_accession[accession] = latest_path
-            return ranked_paths_by_accession
-
-        idf_list_ = []
-        sdrf_list_ = []
-
-        # analysis files parsed for metadata on how the analysis was done.
-        analysis_list = []
-
-        for path, metadata in tqdm(self.sources_config.items(), unit='Paths in config'):
-            print('IDF/SDRF path finder exploring {}'.format(path))
-            idf_list_ += glob.glob(path + '/*/*idf.txt') + glob.glob(path + '/*idf.txt')
-            sdrf_list_ += glob.glob(path + '/*/*sdrf.txt') + glob.glob(path + '/*sdrf.txt')
-            analysis_list += glob.glob(path + '/*/*analysis-methods.tsv') + glob.glob(path + '/*-analysis-methods.tsv')
-
-        idf_list = [x for x in idf_list_ if self.accession_regex.match(x.split('/')[-1].replace('.idf.txt', '').replace('.sdrf.txt', '').replace('-idf.txt', '').replace('-sdrf.txt', ''))]
-        sdrf_list = [x for x in sdrf_list_ if self.accession_regex.match(x.split('/')[-1].replace('.idf.txt', '').replace('.sdrf.txt', '').replace('-idf.txt', '').replace('-sdrf.txt', ''))]
-
-        ranked_paths = get_ranked_paths()
-        idf_path_by_accession = get_latter_ranked_path(list_converter(idf_list), ranked_paths)
-        sdrf_path_by_accession = get_latter_ranked_path(list_converter(sdrf_list), ranked_paths)
-        analysis_path_by_accession = get_latter_ranked_path(list_converter(analysis_list), ranked_paths)
-
-        # get the path where the accession was initially found at
-        paths_by_accession = defaultdict(list)
-        for k, v in self.found_accessions.items():
-            paths_by_accession[v.get('accession')].append(k[0])
-        path_by_accession = get_latter_ranked_path(paths_by_accession, ranked_paths)
-
-        return idf_path_by_accession, sdrf_path_by_accession, path_by_accession, analysis_path_by_accession
+        for path, manifest in self.manifests.items():
+            for kind, file_list in (('idf', manifest.idf_files), ('sdrf', manifest.sdrf_files)):
+                for filepath in file_list:
+                    accession = file_accession(filepath)
+                    if self.accession_regex.match(accession):
+                        self.index.add_file(kind, path, filepath, accession)
+            # analysis files parsed for metadata on how the analysis was done.
+            for filepath in manifest.analysis_files:
+                self.index.add_file('analysis', path, filepath)
+
+        return self.index.files['idf'], self.index.files['sdrf'], self.index.path(), self.index.files['analysis']
@@ -0,0 +1,142 @@
+'''
+append-only history of tracker fields per accession
+
+Each run is compared with the state left by the previous run and only the fields that changed are stored,
+as (run, accession, field, old value, new value) transitions in SQLite. Transitions are indexed by accession
+and by run so a timeline or "what changed since run X" is a single indexed query.
+current_state holds the latest value of every field and is what the next run is compared against.
+'''
+__author__ = "agent"
+__license__ = "Apache 2.0"
+__date__ = "17/10/2026"
+
+import os
+import sqlite3
+import pandas as pd
+from app.lib import atomicFile
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (run_id INTEGER PRIMARY KEY, timestamp TEXT NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS transitions (run_id INTEGER NOT NULL REFERENCES runs(run_id), accession TEXT NOT NULL,
+                                        field TEXT NOT NULL, old_value TEXT, new_value TEXT);
+CREATE INDEX IF NOT EXISTS transitions_accession ON transitions (accession, run_id);
+CREATE INDEX IF NOT EXISTS transitions_run ON transitions (run_id);
+CREATE TABLE IF NOT EXISTS current_state (accession TEXT NOT NULL, field TEXT NOT NULL, value TEXT NOT NULL,
+                                          PRIMARY KEY (accession, field));
+'''
+
+
+def connect(db_path):
+    atomicFile.make_dir(os.path.dirname(db_path))
+    db = sqlite3.connect(db_path)
+    db.executescript(SCHEMA)
+    return db
+
+
+def long_state(output_dfs):
+    '''
+    returns (accession, field, value) rows of every non empty cell in the output frames, values as strings
+    '''
+    frames = []
+    for df in output_dfs.values():
+        long = df.rename_axis('accession').reset_index().melt(id_vars='accession', var_name='field', value_name='value')
+        long = long[long['value'].notnull()]
+        frames.append(long.assign(value=long['value'].astype(str)))
+    if not frames:
+        return pd.DataFrame(columns=['accession', 'field', 'value'])
+    state = pd.concat(frames, ignore_index=True)
+    state = state[state['value'] != '']
+    return state.drop_duplicates(['accession', 'field'], keep='last')
+
+
+def record_run(db_path, timestamp, output_dfs):
+    '''
+    Stores the transitions between the last recorded state and output_dfs under a new run.
+    A run already recorded under timestamp is not recorded again. Returns the number of transitions.
+    '''
+    db = connect(db_path)
+    try:
+        if db.execute('SELECT 1 FROM runs WHERE timestamp = ?', (timestamp,)).fetchone():
+            print('Run {} is already in the status history'.format(timestamp))
+            return 0
+
+        new = long_state(output_dfs)
+        old = pd.read_sql_query('SELECT accession, field, value FROM current_state', db)
+        merged = old.merge(new, on=['accession', 'field'], how='outer', suffixes=('_old', '_new'))
+        changed = merged[merged['value_old'].ne(merged['value_new'])]
+        changed = changed.astype(object).where(changed.notnull(), None)
+
+        with db:
+            run_id = db.execute('INSERT INTO runs (timestamp) VALUES (?)', (timestamp,)).lastrowid
+            db.executemany('INSERT INTO transitions VALUES (?, ?, ?, ?, ?)',
+                           ((run_id, x.accession, x.field, x.value_old, x.value_new)
+                            for x in changed.itertuples(index=False)))
+            removed = changed[changed['value_new'].isnull()]
+            db.executemany('DELETE FROM current_state WHERE accession = ? AND field = ?',
+                           removed[['accession', 'field']].itertuples(index=False, name=None))
+            updated = changed[changed['value_new'].notnull()]
+            db.executemany('INSERT OR REPLACE INTO current_state VALUES (?, ?, ?)',
+                           updated[['accession', 'field', 'value_new']].itertuples(index=False, name=None))
+        print('Status history: {} field changes recorded for run {}'.format(len(changed), timestamp))
+        return len(changed)
+    finally:
+        db.close()
+
+
+def run_id(db, run):
+    '''
+    run id of a run given as its id or timestamp
+    '''
+    if str(run).isdigit():
+        return int(run)
+    row = db.execute('SELECT run_id FROM runs WHERE timestamp = ?', (run,)).fetchone()
+    if row is None:
+        raise ValueError('Run {} is not in the status history'.format(run))
+    return row[0]
+
+
+def runs(db_path):
+    '''
+    returns [(run_id, timestamp, number of transitions)] oldest first
+    '''
+    db = connect(db_path)
+    try:
+        return db.execute('SELECT runs.run_id, timestamp, COUNT(transitions.run_id) FROM runs '
+                          'LEFT JOIN transitions ON transitions.run_id = runs.run_id '
+                          'GROUP BY runs.run_id ORDER BY runs.run_id').fetchall()
+    finally:
+        db.close()
+
+
+def timeline(db_path, accession, field=None):
+    '''
+    returns [(timestamp, field, old value, new value)] of an accession oldest first, optionally for one field
+    '''
+    query = ('SELECT timestamp, field, old_value, new_value FROM transitions JOIN runs USING (run_id) '
+             'WHERE accession = ?')
+    params = [accession]
+    if field:
+        query += ' AND field = ?'
+        params.append(field)
+    db = connect(db_path)
+    try:
+        return db.execute(query + ' ORDER BY run_id, field', params).fetchall()
+    finally:
+        db.close()
+
+
+def changes_since(db_path, run, field=None):
+    '''
+    returns [(timestamp, accession, field, old value, new value)] of runs after run (id or timestamp)
+    '''
+    db = connect(db_path)
+    try:
+        query = ('SELECT timestamp, accession, field, old_value, new_value FROM transitions JOIN runs USING (run_id) '
+                 'WHERE run_id > ?')
+        params = [run_id(db, run)]
+        if field:
+            query += ' AND field = ?'
+            params.append(field)
+        return db.execute(query + ' ORDER BY run_id, accession, field', params).fetchall()
+    finally:
+        db.close()
@@ -7,7 +7,8 @@ Crawls for idf/sdrf for metadata
 Crawls dbs for metadata
 assembles tracker info in dataframes
 exports to google sheets
-exports to pickle dump
+saves a versioned snapshot of the run
+refreshes the accession lookup and accession marks used by the dev tools
 """
 
 __author__ = "hewgreen"
@@ -17,88 +18,179 @@ __date__ = "08/11/2019"
 from app.lib import statusCrawl
 from app.lib import fileCrawler
 from app.lib import dbCrawl
-from app.lib.googleAPI import google_sheet_output
+from app.lib import httpFetch
+from app.lib import outputFormat
+from app.lib import outputSinks
+from app.lib import statusHistory
+from app.lib import stageCheckpoints
+from app.lib import autoConfig
+from app.lib import accessionLookup
+from app.lib import accessionAllocator
+from app.lib import atomicFile
 from datetime import datetime
 import pandas as pd
 from collections import OrderedDict
 from collections import defaultdict
-import pickle
 import json
 import os
 import sys
 import requests
 import re
-import math
 import numpy as np
 import time
 import psycopg
 import logging
 import shutil
+import itertools
+
+
+def explode_lists(series):
+    # one row per list item under the index of its list, an empty list gives one NaN row like Series.explode,
+    # which needs pandas 0.25
+    lengths = series.map(len).clip(lower=1).values.astype(np.int64)
+    values = list(itertools.chain.from_iterable(x if len(x) else [np.nan] for x in series.values))
+    return pd.Series(values, index=series.index.repeat(lengths), dtype=object)
 
 
 class tracker_build:
-    def __init__(self, sources_config, db_config, atlas_supported_species, spreadsheetname, google_client_secret=None):
+    def __init__(self, sources_config, db_config, atlas_supported_species, spreadsheetname, google_client_secret=None,
+                 parse_cache=None, rebuild_parse_cache=False, workers=1, pool='thread', source_timeout=None,
+                 http_cache=None, db_snapshot=None, db_snapshot_ttl=0, sheet_mode='full', sheet_snapshots=None,
+                 sheet_progress=None, sinks=('google',), output_dir='output', run_snapshots=None,
+                 status_history=None, autoconfig_workers=4, autoconfig_timeout=3600,
+                 autoconfig_registry=None, autoconfig_retry_days=7, accession_lookup=None,
+                 accession_marks=None, source_health='logs/source_health.json', require_all_sources=False):
         logging.debug("Starting tracker build in debug model")
 
-        # robust tries with backoff
+        # where output_dfs are written, see outputSinks.py
+        self.sinks = outputSinks.build_sinks(sinks, output_dir=output_dir, google_client_secret=google_client_secret,
+                                             spreadsheetname=spreadsheetname, sheet_mode=sheet_mode,
+                                             sheet_snapshots=sheet_snapshots, sheet_progress=sheet_progress)
+
+        # configuration
+        self.timestamp = datetime.fromtimestamp(datetime.now().timestamp()).isoformat()
+        self.status_type_order = ['external', 'incoming', 'loading', 'analysing', 'processed', 'published_dev', 'published']
+        self.google_client_secret = google_client_secret
+        self.spreadsheetname = spreadsheetname
+
+        # robust tries with backoff, a retry resumes from the first failed stage
         tries = 4
         initial_delay = 5
         backoff_rate = 10
+        stages = stageCheckpoints.stage_checkpoints()
 
         for n in range(tries + 1):
             if n != 0:
-                print('Retry no. {}/{}'.format(n, tries))
+                print('Retry no. {}/{}, resuming from {}'.format(n, tries, stages.failed_stage()))
                 print('Waiting {} sec'.format(initial_delay))
                 time.sleep(initial_delay)
                 initial_delay = initial_delay * backoff_rate
             try:
-                # configuration
-                self.timestamp = datetime.fromtimestamp(datetime.now().timestamp()).isoformat()
-                self.status_type_order = ['external', 'incoming', 'loading', 'analysing', 'processed', 'published_dev', 'published']
-                self.google_client_secret = google_client_secret
-                self.spreadsheetname = spreadsheetname
-                self.atlas_supported_species = self.get_atlas_species(atlas_supported_species)
-
                 # crawling
-                self.status_crawl = statusCrawl.atlas_status(sources_config, self.status_type_order)  # accession search on nfs, glob func
+                self.atlas_supported_species, self.status_crawl = stages.run(
+                    'status crawl', self.crawl_status, sources_config, atlas_supported_species, source_timeout, http_cache,
+                    source_health, require_all_sources)
                 logging.info("Atlas status crawled")
-                self.db_crawl = dbCrawl.db_crawler(db_config, self.status_crawl)  # db lookups for metadata and urls
+                degraded = self.status_crawl.degraded_sources()
+                if degraded:
+                    stages.note('status crawl', 'degraded sources, their accessions are missing from the outputs: {}'.format(
+                        ', '.join(degraded)))
+                self.db_crawl = stages.run('db crawl', dbCrawl.db_crawler, db_config, self.status_crawl,
+                                           snapshot_path=db_snapshot, snapshot_ttl=db_snapshot_ttl)  # db lookups for metadata and urls
                 logging.info("Database crawled")
-                self.file_metadata = fileCrawler.file_crawler(self.status_crawl, sources_config)  # in file crawling on nfs
+                self.file_metadata = stages.run('file crawl', fileCrawler.file_crawler, self.status_crawl, sources_config,
+                                                cache_path=parse_cache, rebuild_cache=rebuild_parse_cache,
+                                                workers=workers, pool=pool)  # in file crawling on nfs
                 logging.info("File metadata crawled")
 
                 # output
-                output_dfs = self.df_compiler()  # this function should be edited to change the information exported to the google sheets output
+                output_dfs = stages.run('compile', self.df_compiler)  # this function should be edited to change the information exported to the google sheets output
                 logging.info("Compile the output into a dataframe")
 
                 # automatically generate Expression Atlas config files for atlas-eligible bulk RNA-seq studies
+                # runs on a copy so a failed attempt leaves the compile checkpoint untouched
                 logging.debug('discover_exp dataframe head:\n {}'.format(output_dfs["Discover Experiments"].head()))
-                output_dfs["Discover Experiments"] = self.auto_config(sources_config, df=output_dfs["Discover Experiments"])
+                output_dfs = OrderedDict(output_dfs)
+                output_dfs["Discover Experiments"] = stages.run('auto_config', self.auto_config, sources_config,
+                                                                df=output_dfs["Discover Experiments"].copy(),
+                                                                workers=autoconfig_workers, timeout=autoconfig_timeout,
+                                                                registry_path=autoconfig_registry,
+                                                                retry_days=autoconfig_retry_days)
                 logging.info("Create config.auto for bulk atlas RNA-seq exps")
 
-                # exported to dev - https://docs.google.com/spreadsheets/d/13gxKodyl-zJTeyCxXtxdw_rp60WJHMcHLtZhxhg5opo/edit#gid=0
-                google_sheet_output(google_client_secret, output_dfs, self.spreadsheetname)
-                logging.info("Save the output into google spreadsheets")
-
-                # self.pickle_out()
+                # google sheet exported to dev - https://docs.google.com/spreadsheets/d/13gxKodyl-zJTeyCxXtxdw_rp60WJHMcHLtZhxhg5opo/edit#gid=0
+                # each destination is checkpointed, a retry only writes to the ones that failed
+                for sink in self.sinks:
+                    stages.run('output {}'.format(sink.name), sink.write, output_dfs)
+                    logging.info("Save the output into {}".format(sink.name))
+
+                if run_snapshots:
+                    stages.run('output snapshot', self.snapshot_out, output_dfs, run_snapshots)
+                if status_history and degraded:
+                    # missing accessions would be recorded as removed and added back by the next run
+                    stages.note('output history', 'skipped, the run is missing degraded sources')
+                elif status_history:
+                    stages.run('output history', statusHistory.record_run, status_history, self.timestamp, output_dfs)  # field transitions per accession
+                if accession_lookup and degraded:
+                    # the previous lookup is kept so the duplication checks still see the missing accessions
+                    stages.note('output accession lookup', 'skipped, the run is missing degraded sources')
+                elif accession_lookup:
+                    stages.run('output accession lookup', accessionLookup.write_lookup, accession_lookup, self.timestamp,
+                               self.internal_accessions(),
+                               self.file_metadata.extracted_metadata.get('Secondary Accession'))  # for dev_tools duplication checks
+                if accession_marks:
+                    stages.run('output accession marks', accessionAllocator.update, accession_marks,
+                               self.status_crawl.all_primary_accessions)  # for dev_tools.accessioner
+                stages.report()
                 break
             except (KeyboardInterrupt, SystemExit):
                 sys.exit()
             except requests.exceptions.HTTPError:
                 logging.error("A server is down (which one see server error message). Please try again when the affected server has been restarted.")
+                stages.report()
                 raise
             except psycopg.OperationalError:
                 logging.error('Problem related to Atlas Production server. Please check if confidentials are up-to-date.\nRemember to update it in db_config.json on cluster if necessary.')
+                stages.report()
                 raise
             except:
-                print('Attempt {} FAILED'.format(n + 1))
+                print('Attempt {} FAILED in stage {}'.format(n + 1, stages.failed_stage()))
                 print("Unexpected error:", sys.exc_info()[0])
                 if n == tries:
+                    stages.report()
                     raise RuntimeError('Hit {} max retries. See errors above'.format(tries))
                 continue
 
+    def crawl_status(self, sources_config, atlas_supported_species, source_timeout=None, http_cache=None,
+                     source_health=None, require_all_sources=False):
+        """
+        Species lists and accession search on nfs/web sources. Returns (supported species, atlas_status)
+        The health of every source is written to source_health. The run carries on with the sources that finished,
+        unless require_all_sources is set: then a degraded source fails the stage and it is crawled again on retry.
+        """
+        http = httpFetch.http_fetcher(cache_dir=http_cache)  # pooled session shared by all web lookups
+        try:
+            try:
+                species = self.get_atlas_species(atlas_supported_species, http)
+            except requests.exceptions.HTTPError as e:
+                # e.g. a GitHub rate limit outlasting the session retries, left to the tracker retries with backoff
+                # instead of the HTTPError handler that aborts the run
+                raise RuntimeError('Species lists could not be fetched: {}'.format(e)) from e
+            status_crawl = statusCrawl.atlas_status(sources_config, self.status_type_order,
+                                                    source_timeout=source_timeout, http=http)  # accession search on nfs, scandir func
+        finally:
+            http.close()
+
+        if source_health:
+            atomicFile.write_json(source_health, dict(timestamp=self.timestamp, sources=status_crawl.source_health), indent=1)
+        degraded = status_crawl.degraded_sources()
+        if degraded and require_all_sources:
+            logging.error('Degraded sources, the tracker is not published without them: {}'.format(', '.join(degraded)))
+            raise RuntimeError('{} source(s) degraded: {}'.format(len(degraded), ', '.join(degraded)))
+        return species, status_crawl
+
     @staticmethod
-    def get_atlas_species(supported_species):
+    def get_atlas_species(supported_species, http=None):
         """
         Supported species taken from list fo files in github here https://github.com/ebi-gene-expression-group/atlas-annotations/tree/develop/annsrcs
         For each git directory find the api url and pass to this function e.g. https://api.github.com/repos/ebi-gene-expression-group/atlas-annotations/git/trees/763aa3ef034348daa0e189d0c52c17edc9a97afc
@@ -106,16 +198,20 @@ class tracker_build:
         These directories contain files whose name are the species we support.
         This function just returns file names as a list.
         These are the species names that Atlas supports.
+        Trees are fetched concurrently and revalidated against the http cache when one is configured.
         """
 
+        own_http = http is None
+        http = http or httpFetch.http_fetcher()
         species_list = []
-        for url in supported_species:
-            response = requests.request("GET", url)
-            assert response.status_code == 200, 'Bad response {} for URL {}'.format(response.status_code, url)
-            data = response.json()
-            for doc in data.get('tree'):
-                species_name = re.sub('[^A-Za-z0-9]+', ' ', doc.get('path')).lower()  # sanitise special chars
-                species_list.append(species_name)
+        try:
+            for data in http.get_json_many(supported_species):
+                for doc in data.get('tree'):
+                    species_name = re.sub('[^A-Za-z0-9]+', ' ', doc.get('path')).lower()  # sanitise special chars
+                    species_list.append(species_name)
+        finally:
+            if own_http:
+                http.close()
         return species_list
 
     def get_species_status(self):
@@ -137,58 +233,92 @@ class tracker_build:
         1. Check if any secondary accessions in the internal sheet are in the secondary accessions external sheet
         2. Check if any primary accessions in the internal sheet are in the secondary accessions external sheet (CURD usacase)
         3. If primary GEO accessions in the discovery are converted to GSE. Do these match any secondary accessions in the internal sheet?
-        """
-
-        already_ingested_warning = {}
-
-        def reverse_dictionary(d):
-            rev_d = defaultdict(list)
-            for key, value_list in d.items():
-                assert type(value_list) == list or math.isnan(value_list), 'This method only works with list dict types. Value: "{}" is type "{}"'.format(value_list, type(value_list))
-                if type(value_list) == list:
-                    for v in value_list:
-                        rev_d[v].append(key)
-            return rev_d
 
-        in_2nd_acc = in_df['Secondary Accessions'].to_dict()
-        ex_2nd_acc = ex_df['Secondary Accessions'].to_dict()
-
-        reverse_in_2nd_acc = reverse_dictionary(in_2nd_acc)  # reverse dict used for lookup
-
-        for accession, secondary_accession in ex_2nd_acc.items():
-            if isinstance(secondary_accession, list) and isinstance(accession, str):
-                assert all(isinstance(item, str) for item in secondary_accession), 'Wrong datatype in secondary accession list: {}'.format(str(secondary_accession))
-
-                # Special treatment for GEO
-                geo_prefix = 'E-GEOD-'  # warning hard coded
-                geo_replacement = 'GSE'  # warning hard coded
-                if accession.startswith(geo_prefix):
-                    all_accessions = [accession] + secondary_accession + [accession.replace(geo_prefix, geo_replacement)]
-                else:
-                    all_accessions = [accession] + secondary_accession
+        Done as a merge of exploded accession keys. Only external rows with a secondary accession list are checked.
+        Each external accession's candidates are ordered (primary, secondaries, GSE conversion) and the warning lists
+        the internal accessions hit by the last candidate with hits, in internal sheet order.
+        """
 
-                for a in all_accessions:
-                    hits = []
-                    if a in reverse_in_2nd_acc:
-                        hits += reverse_in_2nd_acc.get(a)
-                    if hits:
-                        m = 'WARNING Already Ingested. See {}'.format(' & '.join(hits))
-                        already_ingested_warning[accession] = m
+        # Special treatment for GEO
+        geo_prefix = 'E-GEOD-'  # warning hard coded
+        geo_replacement = 'GSE'  # warning hard coded
+
+        in_2nd_acc = in_df['Secondary Accessions']
+        in_is_list = in_2nd_acc.map(type).eq(list)
+        assert (in_is_list | in_2nd_acc.isnull()).all(), 'This method only works with list dict types. Values: "{}"'.format(
+            in_2nd_acc[~(in_is_list | in_2nd_acc.isnull())].head().to_dict())
+
+        # internal lookup, one row per (secondary accession, internal accession)
+        in_exploded = explode_lists(in_2nd_acc[in_is_list]).dropna()
+        internal = pd.DataFrame({'key': in_exploded.values,
+                                 'internal': in_exploded.index,
+                                 'in_pos': np.arange(len(in_exploded))})
+
+        ex_2nd_acc = ex_df['Secondary Accessions']
+        ex_lists = ex_2nd_acc[ex_2nd_acc.map(type).eq(list)]
+        ex_exploded = explode_lists(ex_lists)
+        # 1-based position of each secondary accession within its list (empty lists explode to one NaN row)
+        list_lengths = ex_lists.map(len).clip(lower=1).values.astype(np.int64)
+        list_pos = np.arange(list_lengths.sum()) - np.repeat(np.cumsum(list_lengths) - list_lengths, list_lengths) + 1
+        not_null = ex_exploded.notnull().values
+        ex_exploded = ex_exploded[not_null]
+        assert ex_exploded.map(type).eq(str).all(), 'Wrong datatype in secondary accession list: {}'.format(
+            ex_exploded[~ex_exploded.map(type).eq(str)].head().to_dict())
+
+        # external candidates in check order: primary, secondary accessions, GEO primary converted to GSE
+        ex_accessions = ex_lists.index.to_series()
+        geo = ex_accessions[ex_accessions.str.startswith(geo_prefix)]
+        candidates = pd.concat([
+            pd.DataFrame({'external': ex_accessions.values, 'key': ex_accessions.values, 'pos': 0}),
+            pd.DataFrame({'external': ex_exploded.index, 'key': ex_exploded.values,
+                          'pos': list_pos[not_null]}),
+            pd.DataFrame({'external': geo.values, 'key': geo.str.replace(geo_prefix, geo_replacement, regex=False).values,
+                          'pos': np.iinfo(np.int64).max}),
+        ], ignore_index=True)
+
+        candidates = candidates[candidates['key'].isin(internal['key'])]  # cheap hash filter before the merge
+        hits = candidates.astype({'key': object}).merge(internal.astype({'key': object}), on='key', how='inner')
+        hits = hits[hits['pos'] == hits.groupby('external')['pos'].transform('max')].sort_values('in_pos', kind='mergesort')
+
+        # most accessions hit a single internal accession, only group the rest to join their hits
+        single = ~hits['external'].duplicated(keep=False)
+        joined = pd.concat([hits[single].set_index('external')['internal'],
+                            hits[~single].groupby('external', sort=False)['internal'].agg(' & '.join)])
+        warnings = 'WARNING Already Ingested. See ' + joined
 
         # add new dict to external df
-        ex_df['Already Ingested'] = pd.Series(already_ingested_warning)
+        ex_df['Already Ingested'] = pd.Series(warnings.to_dict())
         return ex_df
 
     @staticmethod
-    def formatting(col):
+    def build_frame(input_dicts, status_type_order):
         """
-        Rules for each cell in dataframe applied afterwards
-        This is slightly slower than pre deciding but allows formatting to be applied generally.
+        Builds the summary dataframe column-wise from the accession keyed dictionaries.
+        Rows are ordered by first appearance across input_dicts and columns by the first row that has them,
+        which is the layout the previous row-wise DataFrame.from_dict(orient='index') construction produced.
+        Rows without a status are dropped (ID found in DB not in config loc).
+        min_order_index is the integer code of min_status in status_type_order (ordered categorical) so filtering
+        and sorting on status stay vectorized.
         """
-
-        for k, v in col.items():
-            if isinstance(v, list):
-                col.loc[k] = ' & '.join(v)
+        index = pd.Index(list(dict.fromkeys(itertools.chain.from_iterable(input_dicts.values()))), dtype=object)
+
+        columns = OrderedDict()
+        first_row = {}
+        for position, (colname, input_dict) in enumerate(input_dicts.items()):
+            rows = index.get_indexer(list(input_dict.keys()))
+            values = np.full(len(index), np.nan, dtype=object)
+            values[rows] = list(input_dict.values())
+            first_row[colname] = (rows.min() if len(rows) else len(index), position)
+            columns[colname] = pd.Series(values, index=index).infer_objects()
+
+        full_df = pd.DataFrame(OrderedDict((colname, columns[colname]) for colname in sorted(columns, key=first_row.get)),
+                               index=index)
+        nan_filtered_df = full_df[pd.notnull(full_df['Status'])]
+
+        status_codes = pd.Categorical(nan_filtered_df['min_status'], categories=status_type_order, ordered=True).codes
+        if (status_codes < 0).any():
+            raise ValueError('Unrecognised min_status {}'.format(set(nan_filtered_df['min_status'][status_codes < 0])))
+        return nan_filtered_df.assign(min_order_index=status_codes.astype('int64'))
 
     def df_compiler(self):
         """
@@ -226,19 +356,7 @@ class tracker_build:
                        "min_status": self.status_crawl.accession_min_status,  # filter
                        "max_status": self.status_crawl.accession_min_status  # filter
                        }
-        input_data = {}
-        for colname, input_dict in input_dicts.items():
-            for accession, value in input_dict.items():
-                if accession not in input_data:
-                    input_data[accession] = {colname: value}
-                else:
-                    input_data[accession].update({colname: value})
-
-        # df parsing/filtering
-        full_df = pd.DataFrame.from_dict(input_data, orient='index')
-        nan_filtered_df = full_df[pd.notnull(full_df['Status'])]  # filter if status is missing (ID found in DB not in config loc)
-
-        nan_filtered_df['min_order_index'] = nan_filtered_df.apply(lambda x: self.status_type_order.index(x['min_status']), axis=1)  # add index column
+        nan_filtered_df = self.build_frame(input_dicts, self.status_type_order)
 
         external_df_ = nan_filtered_df[(nan_filtered_df["min_order_index"] < 1)].rename_axis(index='Accession')  # filter out loading and lower (index based see status_type_order!)
         internal_df = nan_filtered_df[(nan_filtered_df["min_order_index"] >= 1)].rename_axis(index='Accession')  # filter out loading and lower (index based see status_type_order!)
@@ -268,15 +386,23 @@ class tracker_build:
         for name, df in output_dfs.items():
             output_dfs[name] = df.drop(remove_cols, axis=1)
 
-        # add value formatting function here e.g. list and none handling
+        # add value formatting function here e.g. list and none handling, see outputFormat.py
         for name, df in output_dfs.items():
-            df.apply(self.formatting)
+            output_dfs[name] = outputFormat.join_list_cells(df)
 
         return output_dfs
 
     @staticmethod
-    def auto_config(sources_config, df):
+    def auto_config(sources_config, df, workers=4, timeout=3600, registry_path=None, retry_days=7):
+        """
+        Generates config.auto for atlas-eligible bulk RNA-seq experiments without one in conan_incoming, see autoConfig.py.
+        workers experiments are generated at a time, each generation call is stopped after timeout seconds.
+        Experiments that failed before are skipped until their inputs change or retry_days have passed.
+        """
         df["AutoConfig Location"] = ""
+        pending = []
+        registry = autoConfig.attempt_registry(registry_path, retry_days)
+        skipped = 0
 
         # bacterial studies are not ingested into Altas anymore, so not create auto configs for them.
         # currently simply exclude bacteria in atlas-eligible species list at:
@@ -321,7 +447,7 @@ class tracker_build:
                 if os.path.exists(exp_path):
                     # remove empty exp folder if it exists in conan_incoming
                     if len(os.listdir(exp_path)) == 0:
-                        os.remove(exp_path)
+                        os.rmdir(exp_path)
                         logging.debug('delete %s\'s empty folder in conan_incoming for auto generation', exp)
                     # skip, if config.auto has been created
                     else:
@@ -329,51 +455,57 @@ class tracker_build:
                         df.loc[exp, "AutoConfig Location"] = exp_path
                         continue
 
-                # if exp folder not existed in conan_incoming, create the folder and generate config files
-                if not os.path.exists(exp_path):
-                    os.makedirs(exp_path)
+                # if exp folder not existed in conan_incoming, the folder is created and config files generated below
+                if registry.should_attempt(exp, autoConfig.input_fingerprint(row)):
+                    pending.append(exp)
+                else:
+                    logging.debug('%s failed config generation with the same inputs recently, skip', exp)
+                    skipped += 1
+
+        if skipped:
+            print('{} experiments skipped for auto config, they failed recently with unchanged inputs'.format(skipped))
 
-                    # first try differential by default
-                    exitcode_d = os.system(
-                        'conda run -n curation gxa_generateConfigurationForExperiment.pl -e ' + exp + ' -t differential -p ' + (
-                            "annotare" if "MTAB" in exp else "geo") + ' -o ' + exp)
-                    if exitcode_d == 0:
-                        logging.info("%s differential auto config created", exp)
-                        df.loc[exp, "AutoConfig Location"] = exp_path
-                    else:  # try with baseline
-                        exitcode_b = os.system(
-                            'conda run -n curation gxa_generateConfigurationForExperiment.pl -e ' + exp + ' -t baseline -p ' + (
-                                "annotare" if "MTAB" in exp else "geo") + ' -o ' + exp)
-                        if exitcode_b == 0:
-                            logging.info("%s baseline auto config created", exp)
-                            df.loc[exp, "AutoConfig Location"] = exp_path
-                        else:
-                            logging.info('%s failed both differential and baseline config generation', exp)
-                            shutil.rmtree(exp_path)
-                            logging.debug('delete %s\'s folder in conan_incoming', exp)
+        # differential then baseline per experiment, experiments run concurrently
+        for exp, analysis_type in autoConfig.generate_configs(pending, conan_incoming, workers=workers,
+                                                              timeout=timeout).items():
+            registry.record(exp, analysis_type, autoConfig.input_fingerprint(df.loc[exp]))
+            if analysis_type:
+                df.loc[exp, "AutoConfig Location"] = conan_incoming + '/' + exp
+        registry.save()
 
         return df
 
-    def pickle_out(self):
+    def internal_accessions(self):
+        # accessions of the internal sheets, min status past external as in the split of output_dfs
+        return [x for x, status in self.status_crawl.accession_min_status.items() if status != self.status_type_order[0]]
+
+    def snapshot_out(self, output_dfs, snapshot_root):
+        """
+        Saves the output frames and accession indexes of this run, see runSnapshot.py, and applies rolling retention.
+        """
+        from app.lib import runSnapshot  # needs pyarrow, only loaded when snapshots are on
+
         if not os.path.exists('logs'):
             os.makedirs('logs')
 
-        # binary log of results
-        filename = 'logs/' + str(self.timestamp) + '.atlas_status.log'
-        filehandler = open(filename, 'wb')
-        pickle.dump(self, filehandler)
-        print('Crawler results dumped to pickle')
-
         # human readable log
         filename = 'logs/last_run_text.log'
         data = {
             "Primary accessions found": list(self.status_crawl.all_primary_accessions),
             "Detected empty file error": list(self.file_metadata.emptyfile_error_paths),
-            "Detected unicode errors": list(self.file_metadata.unicode_error_paths)
+            "Detected unicode errors": list(self.file_metadata.unicode_error_paths),
+            "Source health": self.status_crawl.source_health
         }
         with open(filename, 'w') as filehandler:
             json.dump(data, filehandler)
 
+        # accessions are in the snapshot indexes, the manifest only keeps the count
+        run_info = dict(data, **{"Primary accessions found": len(data["Primary accessions found"])})
+        indexes = runSnapshot.accession_indexes(self.status_crawl, self.file_metadata.extracted_metadata)
+        snapshot_dir = runSnapshot.write_snapshot(snapshot_root, self.timestamp, output_dfs, indexes, run_info)
+        print('Run snapshot saved to {}'.format(snapshot_dir))
+        runSnapshot.retain(snapshot_root)
+
 
 '''
 Profiling performed before refactoring
@@ -381,10 +513,11 @@ Profiling performed before refactoring
 Top 3 modules by % runtime:
 
 idf_sdrf_metadata_scraper 69% This has since been updated and is 10x faster
-get_latest_idf_sdrf 20%
-get_file_modified_date 8.3%
+get_latest_idf_sdrf 20% Now reads the single scandir pass in fsWalk instead of globbing
+get_file_modified_date 8.3% Now reuses stat results captured by fsWalk
 
 idf_sdrf_metadata_scraper: opens and reads files therefore takes some time. Other tweeks were not faster.
-get_latest_idf_sdrf: not looked at improving this yet
+get_latest_idf_sdrf: globbing replaced by the shared fsWalk manifest
 get_file_modified_date: This could be used to checkup against last pickled run output to avoid opening files that were already read if speed becomes a blocker
+(done in parseCache.py, keyed by the same stat results)
 '''
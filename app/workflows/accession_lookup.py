@@ -0,0 +1,62 @@
+'''
+Looks up internal accessions for primary, secondary and GEO accessions (see accessionLookup.py).
+
+python -m app.workflows.accession_lookup E-MTAB-1234 GSE12345
+python -m app.workflows.accession_lookup -f accessions.txt
+python -m app.workflows.accession_lookup --rebuild
+'''
+
+__author__ = "agent"
+__license__ = "Apache 2.0"
+__date__ = "17/10/2026"
+
+import argparse
+import sys
+from app.lib import accessionLookup
+
+
+def parameters():
+    parser = argparse.ArgumentParser(description='Find the internal accessions known for accessions.')
+    parser.add_argument("accessions", nargs='*', help="Primary, secondary or GEO accessions.")
+    parser.add_argument("-f", "--file", dest="file", help="File with one accession per line, - for stdin.")
+    parser.add_argument("-d", "--lookup", dest="lookup", default='logs/accession_lookup.sqlite',
+                        help="Accession lookup written by run_status_crawler.py.")
+    parser.add_argument("-k", "--kinds", dest="kinds", nargs='+', choices=accessionLookup.KINDS,
+                        default=list(accessionLookup.KINDS), help="Kinds of match to report.")
+    parser.add_argument("--rebuild", dest="rebuild", action='store_true',
+                        help="Rewrite the lookup from the latest run snapshot instead of querying.")
+    parser.add_argument("--snapshot_root", dest="snapshot_root", default='logs/snapshots',
+                        help="Run snapshots used by --rebuild.")
+    args = parser.parse_args()
+    if not args.rebuild and not args.accessions and not args.file:
+        parser.error('give accessions, --file or --rebuild')
+    return args
+
+
+def rebuild(lookup_path, snapshot_root):
+    from app.lib import runSnapshot  # only needed here, queries should not load pandas
+    saved = runSnapshot.saved_status(runSnapshot.latest_snapshot(snapshot_root))
+    accessionLookup.write_lookup(lookup_path, runSnapshot.read_manifest(saved.snapshot_dir)['timestamp'],
+                                 saved.internal_accessions, saved.secondary_accessions_mapping)
+
+
+def read_accessions(path):
+    f = sys.stdin if path == '-' else open(path)
+    try:
+        return [x.strip() for x in f if x.strip()]
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+if __name__ == '__main__':
+    args = parameters()
+    if args.rebuild:
+        rebuild(args.lookup, args.snapshot_root)
+    else:
+        accessions = args.accessions + (read_accessions(args.file) if args.file else [])
+        found = accessionLookup.lookup(args.lookup, accessions, args.kinds)
+        print('\t'.join(['accession', 'kind', 'internal accession']))
+        for accession in dict.fromkeys(x.strip() for x in accessions):
+            for kind, internal in found.get(accession, [('', '')]):
+                print('\t'.join([accession, kind, internal]))
@@ -1,6 +1,5 @@
-
 '''
-Quick pickle reader writer. Takes any previous log output '<timestamp>.atlas_status.log' and writes it to the shared Google shpreadsheet.
+Quick snapshot reader writer. Takes a previous run snapshot 'logs/snapshots/<timestamp>' and writes it to the shared Google shpreadsheet.
 This is useful to restore the sheet to a previous version.
 Designed to be ran as a one off to restore.
 
@@ -13,19 +12,28 @@ __license__ = "Apache 2.0"
 __date__ = "29/07/2019"
 
 import argparse
-import pickle
+from app.lib import runSnapshot
+from app.lib.googleAPI import google_sheet_output
+
 
 def parameters():
-    parser = argparse.ArgumentParser(description='Load a previously ran atlas status log into the shared google sheet.')
-    parser.add_argument("-s", "--sheet", dest="sheet",
-                        help="Path to pickle log output e.g. 'logs/2019-07-29T08:19:06.148654.atlas_status.log",
+    parser = argparse.ArgumentParser(description='Load a previously ran tracker snapshot into the shared google sheet.')
+    parser.add_argument("-s", "--snapshot", dest="snapshot",
+                        help="Path to a run snapshot e.g. 'logs/snapshots/2019-07-29T08:19:06.148654'. Defaults to the latest in --snapshot_root.")
+    parser.add_argument("--snapshot_root", dest="snapshot_root", default='logs/snapshots',
+                        help="Directory of run snapshots.")
+    parser.add_argument("-g", "--google_client_secret", dest="google_client_secret",
+                        help="Connection info for output Google Sheet. Private doc available locally.",
                         required=True)
+    parser.add_argument("-n", "--sheetname", dest="sheetname",
+                        help="Name of output sheet. Must be in same loc as defined in Google Client Secret",
+                        default='DEV Ingest Status')
     return parser.parse_args()
 
 
 if __name__ == '__main__':
     args = parameters()
-    with open(args.sheet, 'rb') as f:
-        atlas_status = pickle.load(f)
-    output_df = atlas_status.df_compiler()
-    atlas_status.google_sheet_output(output_df)
\ No newline at end of file
+    snapshot = args.snapshot or runSnapshot.latest_snapshot(args.snapshot_root)
+    print('Restoring {}'.format(snapshot))
+    output_dfs = runSnapshot.load_frames(snapshot)  # compiled frames only, the accession indexes are not read
+    google_sheet_output(args.google_client_secret, output_dfs, args.sheetname)
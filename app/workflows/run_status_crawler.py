@@ -17,6 +17,7 @@ __date__ = "24/07/2019"
 import argparse
 import logging
 from app.lib import trackerBuild
+from app.lib import outputSinks
 
 
 def parameters():
@@ -28,17 +29,67 @@ def parameters():
                         help="Configuration file with db connection settings. Private doc available locally.",
                         required=True)
     parser.add_argument("-g", "--google_client_secret", dest="google_client_secret",
-                        help="Connection info for output Google Sheet. Private doc available locally.",
-                        required=True)
+                        help="Connection info for output Google Sheet. Private doc available locally. Needed by the google sink.")
     parser.add_argument("-n", "--sheetname", dest="sheetname",
                         help="Name of output sheet. Must be in same loc as defined in Google Client Secret",
-                        required=True, default='DEV Ingest Status')
+                        default='DEV Ingest Status')
     parser.add_argument("-q" "--atlas_supported_species", dest='atlas_supported_species', nargs='+',
                         help='Species list. Which genome references are being processed by irap_single_lib',
                         required=True)
+    parser.add_argument("-c", "--parse_cache", dest="parse_cache", default='logs/parse_cache.json',
+                        help="Cache of metadata parsed from idf/sdrf/analysis files. Only new or changed files are re-read.")
+    parser.add_argument("--rebuild_parse_cache", dest="rebuild_parse_cache", action='store_true',
+                        help="Ignore the parse cache and re-read every file on nfs.")
+    parser.add_argument("-w", "--workers", dest="workers", type=int, default=8,
+                        help="Number of workers parsing idf/sdrf/analysis files concurrently. 1 parses serially.")
+    parser.add_argument("--pool", dest="pool", choices=['thread', 'process'], default='thread',
+                        help="Worker pool type for file parsing. Threads suit nfs bound runs.")
+    parser.add_argument("-t", "--source_timeout", dest="source_timeout", type=float, default=1800,
+                        help="Seconds each source path may take to crawl before it is reported as degraded and the run "
+                             "carries on without it. Override per path with 'timeout' in the sources config.")
+    parser.add_argument("--require_all_sources", dest="require_all_sources", action='store_true',
+                        help="Fail and retry the crawl instead of carrying on when a source is degraded.")
+    parser.add_argument("--source_health", dest="source_health", default='logs/source_health.json',
+                        help="Crawl status and latency of each source in the last crawl.")
+    parser.add_argument("--http_cache", dest="http_cache", default='logs/http_cache',
+                        help="Directory caching web sources and species lists. Unchanged urls are revalidated with a 304.")
+    parser.add_argument("--db_snapshot", dest="db_snapshot", default=None,
+                        help="SQLite file the tables read from the dbs are saved to for reuse (e.g. "
+                             "logs/db_snapshot.sqlite), only written with --db_snapshot_ttl. Secret columns are never saved.")
+    parser.add_argument("--db_snapshot_ttl", dest="db_snapshot_ttl", type=float, default=0,
+                        help="Reuse tables from the db snapshot younger than this many seconds. 0 always queries the dbs "
+                             "and saves no snapshot.")
+    parser.add_argument("--sheet_mode", dest="sheet_mode", choices=['full', 'delta'], default='full',
+                        help="full rewrites every worksheet, delta only sends rows changed since the last published copy.")
+    parser.add_argument("--sheet_snapshots", dest="sheet_snapshots", default='logs/sheet_snapshots',
+                        help="Directory with the local copy of each published worksheet, used by --sheet_mode delta.")
+    parser.add_argument("--sheet_progress", dest="sheet_progress", default='logs/sheet_upload_progress.json',
+                        help="Progress of the google sheet upload. An interrupted upload resumes from the last written chunk.")
+    parser.add_argument("--sinks", dest="sinks", nargs='+', choices=outputSinks.SINK_NAMES, default=['google'],
+                        help="Where the tracker is written, any combination of google, parquet, csv and sqlite.")
+    parser.add_argument("-o", "--output_dir", dest="output_dir", default='output',
+                        help="Directory for the parquet, csv and sqlite sinks.")
+    parser.add_argument("--run_snapshots", dest="run_snapshots", default='logs/snapshots',
+                        help="Directory of versioned run snapshots read by the restore script and dev tools, empty to skip.")
+    parser.add_argument("--status_history", dest="status_history", default='logs/status_history.sqlite',
+                        help="Append-only history of field changes per accession, see status_history.py.")
+    parser.add_argument("--accession_lookup", dest="accession_lookup", default='logs/accession_lookup.sqlite',
+                        help="Primary, secondary and GEO accession lookup for the dev tools, see accession_lookup.py.")
+    parser.add_argument("--accession_marks", dest="accession_marks", default='logs/accession_marks.json',
+                        help="Highest accession number per prefix, used to mint new accessions.")
+    parser.add_argument("--autoconfig_workers", dest="autoconfig_workers", type=int, default=4,
+                        help="Experiments generating config.auto at the same time.")
+    parser.add_argument("--autoconfig_timeout", dest="autoconfig_timeout", type=float, default=3600,
+                        help="Seconds a single differential or baseline config generation may take.")
+    parser.add_argument("--autoconfig_registry", dest="autoconfig_registry", default='logs/autoconfig_registry.json',
+                        help="Outcome of past config generation attempts per accession.")
+    parser.add_argument("--autoconfig_retry_days", dest="autoconfig_retry_days", type=float, default=7,
+                        help="Days before a failed config generation with unchanged inputs is attempted again.")
     parser.add_argument('--verbose', '-v', action='store_true', help='Turn on verbose mode for debugging')
 
     args = parser.parse_args()
+    if 'google' in args.sinks and not args.google_client_secret:
+        parser.error('--google_client_secret is required by the google sink')
 
     if args.verbose:
         logging.getLogger().setLevel(logging.DEBUG)
@@ -51,4 +102,15 @@ def parameters():
 if __name__ == '__main__':
     args = parameters()
     trackerBuild.tracker_build(args.sources_config, args.db_config, args.atlas_supported_species, args.sheetname,
-                               args.google_client_secret)
+                               args.google_client_secret, parse_cache=args.parse_cache,
+                               rebuild_parse_cache=args.rebuild_parse_cache, workers=args.workers, pool=args.pool,
+                               source_timeout=args.source_timeout, http_cache=args.http_cache,
+                               db_snapshot=args.db_snapshot, db_snapshot_ttl=args.db_snapshot_ttl,
+                               sheet_mode=args.sheet_mode, sheet_snapshots=args.sheet_snapshots,
+                               sheet_progress=args.sheet_progress, sinks=args.sinks, output_dir=args.output_dir,
+                               run_snapshots=args.run_snapshots, status_history=args.status_history,
+                               autoconfig_workers=args.autoconfig_workers, autoconfig_timeout=args.autoconfig_timeout,
+                               autoconfig_registry=args.autoconfig_registry,
+                               autoconfig_retry_days=args.autoconfig_retry_days,
+                               accession_lookup=args.accession_lookup, accession_marks=args.accession_marks,
+                               source_health=args.source_health, require_all_sources=args.require_all_sources)
@@ -0,0 +1,49 @@
+'''
+Queries the status history recorded by tracker runs (see statusHistory.py).
+
+python -m app.workflows.status_history timeline E-MTAB-1234 --field Status
+python -m app.workflows.status_history changes_since 2026-10-17T08:00:01.123456
+python -m app.workflows.status_history runs
+'''
+
+__author__ = "agent"
+__license__ = "Apache 2.0"
+__date__ = "17/10/2026"
+
+import argparse
+from app.lib import statusHistory
+
+
+def parameters():
+    parser = argparse.ArgumentParser(description='Query the per accession status history of the tracker.')
+    parser.add_argument("-d", "--history", dest="history", default='logs/status_history.sqlite',
+                        help="Status history written by run_status_crawler.py.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    timeline = subparsers.add_parser('timeline', help='Field changes of one accession, oldest first.')
+    timeline.add_argument("accession")
+    timeline.add_argument("-f", "--field", dest="field", help="Only this field, e.g. Status.")
+
+    changes = subparsers.add_parser('changes_since', help='Field changes recorded after a run.')
+    changes.add_argument("run", help="Run id or timestamp, see 'runs'.")
+    changes.add_argument("-f", "--field", dest="field", help="Only this field, e.g. Status.")
+
+    subparsers.add_parser('runs', help='Recorded runs with their number of changes.')
+    return parser.parse_args()
+
+
+def print_rows(header, rows):
+    print('\t'.join(header))
+    for row in rows:
+        print('\t'.join('' if x is None else str(x) for x in row))
+
+
+if __name__ == '__main__':
+    args = parameters()
+    if args.command == 'timeline':
+        print_rows(['timestamp', 'field', 'old', 'new'], statusHistory.timeline(args.history, args.accession, args.field))
+    elif args.command == 'changes_since':
+        print_rows(['timestamp', 'accession', 'field', 'old', 'new'],
+                   statusHistory.changes_since(args.history, args.run, args.field))
+    else:
+        print_rows(['run_id', 'timestamp', 'changes'], statusHistory.runs(args.history))